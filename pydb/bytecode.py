@@ -44,6 +44,17 @@ def next_linestart(co, offset, count=1):
         pass
     return -1000
 
+def code_line_range(co):
+    '''Return a tuple of the smallest and largest line numbers which
+    have code in code object co. co_firstlineno is always included,
+    since a breakpoint set by function name uses that line.'''
+    first = last = co.co_firstlineno
+    for offset, lineno in dis.findlinestarts(co):
+        if lineno < first: first = lineno
+        if lineno > last:  last  = lineno
+        pass
+    return (first, last)
+
 # FIXME: break out into a code iterator.
 def stmt_contains_make_function(co, lineno):
     linestarts = dict(dis.findlinestarts(co))
@@ -85,6 +96,7 @@ if __name__=='__main__':
     print 'contains MAKE_FUNCTION', stmt_contains_make_function(co, lineno-4)
     print 'contains MAKE_FUNCTION', stmt_contains_make_function(co, lineno)
 
+    print "line range of sqr: ", code_line_range(sqr.func_code)
     print "op at frame: ", op_at_frame(frame)
     print "op at frame, position 2", op_at_frame(frame, 2)
     print "def statement: x=5?: ", is_def_stmt('x=5', frame)
@@ -11,12 +11,107 @@ $Id: connection.py,v 1.10 2008/12/22 15:17:25 rockyb Exp $"""
 
 NotImplementedMessage = "This method must be overriden in a subclass"
 
+import errno, os, select, threading
+
+try:
+    import zlib
+except ImportError:
+    zlib = None
+
 ### Exceptions
 class ConnectionFailed(Exception): pass
 class DroppedConnection(Exception): pass
 class ReadError(Exception): pass
 class WriteError(Exception): pass
 
+class LineReader(object):
+    """Split what arrives on a connection into lines. Data is read
+    into one bytearray, which is kept from read to read and only grows
+    when a line doesn't fit, so a line costs one string and as few
+    reads as there are pieces of it to wait for.
+
+    'read_into' reads into the buffer it is given, returning the number
+    of bytes read, 0 at end of file; 'source' is something select()
+    can wait on to see if more is coming.
+    """
+    def __init__(self, read_into, source, size=4096):
+        self.read_into = read_into
+        self.source    = source
+        self.buffer    = bytearray(size)
+        self.start     = self.end = 0  # The unread data is buffer[start:end]
+        self.eof       = False
+
+    def buffered(self):
+        """Return the number of bytes read but not yet used."""
+        return self.end - self.start
+
+    def fill(self):
+        """Read what has arrived, waiting for something if need be."""
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.end == len(self.buffer):
+            # Move what's left to the front, or grow if it's all left.
+            count = self.end - self.start
+            if self.start:
+                self.buffer[:count] = self.buffer[self.start:self.end]
+            else:
+                self.buffer.extend(bytearray(len(self.buffer)))
+            self.start, self.end = 0, count
+        count = self.read_into(memoryview(self.buffer)[self.end:])
+        if not count:
+            self.eof = True
+            raise ReadError, 'Connection closed'
+        self.end += count
+
+    def take(self, end):
+        data = str(self.buffer[self.start:end])
+        self.start = end
+        return data
+
+    def readline(self, partial=True):
+        """Return the next line. If 'partial', and only part of a line
+        has arrived and nothing more is waiting, as after a prompt,
+        return that part."""
+        scanned = 0
+        while True:
+            i = self.buffer.find('\n', self.start + scanned, self.end)
+            if i >= 0:
+                return self.take(i + 1)
+            scanned = self.end - self.start
+            if partial and scanned and \
+                   not select.select([self.source], [], [], 0)[0]:
+                return self.take(self.end)
+            try:
+                self.fill()
+            except ReadError:
+                if not (partial and scanned): raise
+                return self.take(self.end)
+
+    def peek(self):
+        """Return what has been read but not used, waiting for
+        something if there is nothing."""
+        if self.start == self.end: self.fill()
+        return str(self.buffer[self.start:self.end])
+
+    def read(self, size):
+        """Return the next 'size' bytes."""
+        while self.end - self.start < size:
+            self.fill()
+        return self.take(self.start + size)
+
+def file_reader(fileobj):
+    """Return a LineReader for 'fileobj', read with os.read so that we
+    get what is there rather than waiting for a full buffer."""
+    fd = fileobj.fileno()
+    def read_into(buffer):
+        try:
+            data = os.read(fd, len(buffer))
+        except OSError, e:
+            raise ReadError, e[1]
+        buffer[:len(data)] = data
+        return len(data)
+    return LineReader(read_into, fileobj)
+
 class ConnectionInterface(object):
     """ This is an abstract class that specifies the interface a server
     connection class must implement. If a target is given, we'll
@@ -32,8 +127,8 @@ class ConnectionInterface(object):
         raise NotImplementedError, NotImplementedMessage
 
     def readline(self):
-        """ This method reads a line of data of maximum length 'bufsize'
-        from the connected debugger.
+        """ This method reads a line of data from the connected
+        debugger.
         """
         raise NotImplementedError, NotImplementedMessage
 
@@ -71,6 +166,7 @@ class ConnectionSerial(ConnectionInterface):
         except IOError,e:
             # Use e[1] for more detail about why the connection failed
             raise ConnectionFailed, e[1]
+        self.reader = file_reader(self.input)
 
     def disconnect(self):
         """ Close the serial device. """
@@ -79,12 +175,13 @@ class ConnectionSerial(ConnectionInterface):
         self.output.close()
         self.input.close()
 
-    def readline(self, bufsize=2048):
+    def readline(self):
+        """Read a line; '' at end of file."""
         try:
-            line = self.input.readline(bufsize)
-        except IOError, e:
-            raise ReadError, e[1]
-        return line
+            return self.reader.readline()
+        except ReadError:
+            if self.reader.eof: return ''
+            raise
 
     def write(self, msg):
         if msg[-1] is not '\n':
@@ -98,20 +195,25 @@ class ConnectionSerial(ConnectionInterface):
 # end class ConnectionSerial
 
 ### This might go in a different file
-import socket
+import socket, stat
 
 class ConnectionServerTCP(ConnectionInterface):
     """This is an implementation of a server class that uses the TCP
     protocol as its means of communication.
+
+    Besides connect(), which waits for a client and talks to it
+    itself, accept() hands each client its own connection so that
+    we can go on listening.
     """
     def __init__(self):
         self.listening = False
         self._sock = self.output = self.input = None
         ConnectionInterface.__init__(self)
         
-    def connect(self, addr, reuseaddr=True):
-        """Set to allow a connection from a client. 'addr' specifies
-        the hostname and port combination of the server.
+    def listen(self, addr, reuseaddr=True):
+        """Get ready to accept a connection from a client at 'addr',
+        a hostname and port combination. If the port is 0 the system
+        picks a free one; self.port is set to the port used.
         """
         try:
             h,p = addr.split(':')
@@ -119,38 +221,61 @@ class ConnectionServerTCP(ConnectionInterface):
             raise ConnectionFailed, 'Invalid address'
         self.host = h
         self.port = int(p)
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if reuseaddr:
+            self._sock.setsockopt(socket.SOL_SOCKET,
+                                  socket.SO_REUSEADDR, 1)
+        try:
+            self._sock.bind((self.host, self.port))
+        except socket.error, e:
+            # Use e[1] as a more detailed error message
+            raise ConnectionFailed, e[1]
+        self._sock.listen(1)
+        self.port = self._sock.getsockname()[1]
+        self.listening = True
+
+    def connect(self, addr, reuseaddr=True):
+        """Set to allow a connection from a client. 'addr' specifies
+        the hostname and port combination of the server.
+        """
         if not self.listening:
-            self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            if reuseaddr:
-                self._sock.setsockopt(socket.SOL_SOCKET,
-                                      socket.SO_REUSEADDR, 1)
-            try:
-                self._sock.bind((self.host, self.port))
-            except socket.error, e:
-                # Use e[1] as a more detailed error message
-                raise ConnectionFailed, e[1]
-            self._sock.listen(1)
-            self.listening = True
+            self.listen(addr, reuseaddr)
         self.output, addr = self._sock.accept()
         self.input = self.output
+        self.reader = LineReader(self._recv_into, self.input)
+
+    def accept(self):
+        """Wait for a client and return a new connection to it."""
+        client = self.__class__()
+        try:
+            client.output, addr = self._sock.accept()
+        except socket.error, e:
+            raise ConnectionFailed, e[1]
+        client.input = client.output
+        client.reader = LineReader(client._recv_into, client.input)
+        return client
 
     def disconnect(self):
-        if self.output is None or self._sock is None:
-            return
-        self.output.close()
-        self._sock.close()
-        self._sock = None
-        self.listening = False
+        """Close the connection to the client and, if we are the one
+        listening, the socket itself."""
+        if self.output is not None:
+            self.output.close()
+            self.output = self.input = None
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+            self.listening = False
 
-    def readline(self, bufsize=2048):
+    def _recv_into(self, buffer):
         try:
-            line = self.input.recv(bufsize)
+            return self.input.recv_into(buffer)
         except socket.error, e:
             raise ReadError, e[1]
-        if not line:
-            raise ReadError, 'Connection closed'
-        if line[-1] != '\n': line += '\n'
-        return line
+
+    def readline(self):
+        """Read a command. A command may come in several pieces, so
+        we wait for all of the line."""
+        return self.reader.readline(False)
 
     def write(self, msg):
         try:
@@ -185,6 +310,7 @@ class ConnectionClientTCP(ConnectionInterface):
             self._sock.connect((self.host, self.port))
         except socket.error, e:
             raise ConnectionFailed, e[1]
+        self.reader = LineReader(self._recv_into, self._sock)
         self.connected = True
 
     def write(self, msg):
@@ -193,14 +319,18 @@ class ConnectionClientTCP(ConnectionInterface):
         except socket.error, e:
             raise WriteError, e[1]
 
-    def readline(self, bufsize=2048):
+    def fileno(self):
+        """The socket's file descriptor, so that we can be select()ed."""
+        return self._sock.fileno()
+
+    def _recv_into(self, buffer):
         try:
-            line = self._sock.recv(bufsize)
+            return self._sock.recv_into(buffer)
         except socket.error, e:
             raise ReadError, e[1]
-        if not line:
-            raise ReadError, 'Connection closed'
-        return line
+
+    def readline(self):
+        return self.reader.readline()
 
     def disconnect(self):
         """ Close the socket to the server. """
@@ -214,9 +344,65 @@ class ConnectionClientTCP(ConnectionInterface):
 
 #end ConnectionClientTCP
 
-### This might go in a different file
-import os
+class ConnectionServerUnix(ConnectionServerTCP):
+    """A server connection over a Unix-domain socket. The address is
+    the socket's file name; only our own user may connect to it.
+    """
+    def listen(self, addr, reuseaddr=True):
+        """Create the socket 'addr' and get ready to accept clients. A
+        socket left over from an earlier run is removed."""
+        self.host = self.port = None
+        self.path = addr
+        try:
+            if stat.S_ISSOCK(os.stat(addr).st_mode):
+                os.unlink(addr)
+        except OSError:
+            pass
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # The socket is made with mode 0600 rather than changed to it
+        # afterwards, so that no one else can connect in between.
+        umask = os.umask(0177)
+        try:
+            try:
+                self._sock.bind(addr)
+            except socket.error, e:
+                raise ConnectionFailed, e[1]
+        finally:
+            os.umask(umask)
+            pass
+        self._sock.listen(1)
+        self.listening = True
+
+    def disconnect(self):
+        """As for ConnectionServerTCP; the socket file is removed too."""
+        listening = self._sock is not None
+        ConnectionServerTCP.disconnect(self)
+        if listening:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+# end ConnectionServerUnix
 
+class ConnectionClientUnix(ConnectionClientTCP):
+    """ A class that allows a connection to be made from a debugger
+    to a server over a Unix-domain socket.
+    """
+    def connect(self, addr):
+        """Connect to the server listening on socket file 'addr'."""
+        self.path = addr
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._sock.connect(addr)
+        except socket.error, e:
+            raise ConnectionFailed, e[1]
+        self.reader = LineReader(self._recv_into, self._sock)
+        self.connected = True
+
+#end ConnectionClientUnix
+
+### This might go in a different file
 class ConnectionFIFO(ConnectionInterface):
     """A class for communicating akin to a named pipe. Since I haven't
     been able to figure out how to make os.mkfifo work, we'll use two
@@ -259,6 +445,7 @@ class ConnectionFIFO(ConnectionInterface):
             self.inp = open(self.fname_in, 'r')
         except IOError, e:
             raise ConnectionFailed, "%s: %s:" % (self.fname_out, e[1])
+        self.reader = file_reader(self.inp)
         
     def disconnect(self):
         """Close input and output files and remove from the filesystem
@@ -294,13 +481,9 @@ class ConnectionFIFO(ConnectionInterface):
             return self.filename + ".in"
         
     def readline(self):
-        try:
-            line = self.inp.readline()
-        except IOError, e:
-            raise ReadError, e[1]
-        if not line:
-            raise ReadError, 'Connection closed'
-        return line
+        """Read a line. A server waits for all of a command; a client
+        gets what there is after a prompt."""
+        return self.reader.readline(not self.is_server)
 
     def write(self, msg):
         if msg[-1] != '\n': msg += '\n'
@@ -312,6 +495,520 @@ class ConnectionFIFO(ConnectionInterface):
         
 # end ConnectionFIFO
 
+class ConnectionFramed(ConnectionInterface):
+    """Send commands and their output as whole messages, or frames,
+    over another connection. A frame is a header line
+
+        \\x02KIND ID LENGTH
+
+    followed by LENGTH bytes of payload and a newline. The kinds are:
+
+      H  client hello; the server switches to frames
+      C  a command, from the client
+      M  several commands, one per line, from the client
+      O  some of the output of command ID; more follows
+      N  the rest of the output of one command of an M; the output
+         of the next follows
+      E  the rest of the output of command ID, prompt included
+      B  like E, but the server is closing the connection; with ID 0,
+         whatever the client was waiting for
+
+    If the client offers "zlib" in its hello and the server agrees,
+    payloads of compress_threshold bytes or more are compressed,
+    using one zlib stream in each direction so that what was sent
+    before helps. Such frames have a "z" after the kind. Short ones,
+    such as a command or a prompt, are sent as they are.
+
+    A client sends a command and reads frames until the E or B with
+    its ID, so a command takes one round trip however long its
+    output, and nothing depends on spotting the prompt. A batch of
+    commands, say a command file, goes as a single M frame. The
+    server runs them in order and ends the output of each with an N
+    frame, and that of the last with an E.
+
+    On the server side this object stands in for the debugger's
+    stdin and stdout. Output is kept until the debugger flushes it,
+    or there is output_threshold bytes of it, and then goes out as an
+    O frame; so a client sees, say, a line trace while the program
+    runs. The rest goes out in an E frame when the debugger reads its
+    next command. Until a client says hello we pass lines through
+    unchanged, so that clients which don't speak frames still work.
+
+    Frames are read with the LineReader of the connection wrapped.
+    """
+    MARK = '\x02'
+    compress_threshold = 256
+    output_threshold   = 4096
+
+    def __init__(self, connection):
+        ConnectionInterface.__init__(self)
+        self.connection = connection
+        self.is_client  = False  # Did we say hello?
+        self.framed     = False  # Has someone said hello?
+        self.closed     = False  # Closed, or a client sent a B?
+        self.output     = []     # Server: output not sent yet
+        self.output_size = 0     # Server: bytes in output
+        self.request_id = 0      # Id of the last command
+        self.queued     = []     # Server: commands of an M not run yet
+        self.compressor = self.decompressor = None
+        # Payload bytes and the bytes they took on the connection
+        self.bytes_sent = self.wire_sent = 0
+        self.bytes_received = self.wire_received = 0
+
+    def connect(self, addr):
+        self.connection.connect(addr)
+
+    def disconnect(self):
+        """As a server, send any output still waiting as a B frame.
+        Then close the connection."""
+        if self.framed and not (self.is_client or self.closed):
+            try:
+                self.send_output('B')
+            except WriteError:
+                pass
+        self.closed = True
+        self.connection.disconnect()
+
+    def fileno(self):
+        return self.connection.fileno()
+
+    def start_compression(self):
+        self.compressor   = zlib.compressobj()
+        self.decompressor = zlib.decompressobj()
+
+    def send_frame(self, kind, request_id, payload):
+        self.bytes_sent += len(payload)
+        if self.compressor and len(payload) >= self.compress_threshold:
+            payload = self.compressor.compress(payload) + \
+                      self.compressor.flush(zlib.Z_SYNC_FLUSH)
+            kind += 'z'
+        frame = '%s%s %d %d\n%s\n' % (self.MARK, kind, request_id,
+                                      len(payload), payload)
+        self.wire_sent += len(frame)
+        self.connection.write(frame)
+
+    def read_frame(self, line=None):
+        """Read the next frame, whose header may already have been read
+        as 'line'. Returns (text, kind, id, payload) where 'text' is
+        anything that came before the frame outside of one, such as a
+        server's greeting."""
+        reader = self.connection.reader
+        text = []
+        while True:
+            if line is None: line = reader.readline(False)
+            start = line.find(self.MARK)
+            if start >= 0: break
+            text.append(line)
+            line = None
+        text.append(line[:start])
+        try:
+            kind, request_id, size = line[start+1:].rstrip('\n').split(' ')
+            request_id, size = int(request_id), int(size)
+        except ValueError:
+            raise ReadError, 'Bad frame header %s' % repr(line[start:])
+        payload = reader.read(size + 1)[:-1]
+        self.wire_received += len(line) - start + size + 1
+        if kind.endswith('z'):
+            if self.decompressor is None:
+                raise ReadError, 'Compressed frame without compression'
+            try:
+                payload = self.decompressor.decompress(payload)
+            except zlib.error, e:
+                raise ReadError, 'Bad compressed frame: %s' % e
+            kind = kind[:-1]
+        self.bytes_received += len(payload)
+        return ''.join(text), kind, request_id, payload
+
+    ### Client side
+    def hello(self, compress=True):
+        """Ask the server to use frames and, if 'compress' and we have
+        zlib, compression. Returns the server's greeting, what it said
+        before it got to our hello."""
+        self.is_client = self.framed = True
+        self.request_id += 1
+        request_id = self.request_id
+        if compress and zlib: offer = 'zlib'
+        else: offer = ''
+        self.send_frame('H', request_id, offer)
+        greeting = []
+        while True:
+            text, kind, frame_id, payload = self.read_frame()
+            greeting.append(text)
+            if frame_id == request_id: break
+            # A server turning us away may not have waited for our id.
+            if kind == 'B' and frame_id == 0: break
+        if kind == 'B':
+            # Turned away, and told why.
+            greeting.append(payload)
+            self.closed = True
+        elif offer and payload.split() == [offer]:
+            self.start_compression()
+        return ''.join(greeting)
+
+    def command(self, line, kind='C', wait=True, callback=None):
+        """Send command 'line' and, if 'wait', return its output.
+        If 'callback' is given, it is instead called with each piece
+        of the output as it arrives; for an M, with the output of
+        each of its commands."""
+        self.request_id += 1
+        request_id = self.request_id
+        self.send_frame(kind, request_id, line)
+        if not wait: return None
+        output = []
+        if callback is None: callback = output.append
+        pending = []  # Output of the command of an M being run
+        while True:
+            text, frame_kind, frame_id, payload = self.read_frame()
+            if text: callback(text)
+            # Output of a command we stopped waiting for is dropped;
+            # a B with id 0 is the server saying goodbye to all.
+            if frame_id != request_id and \
+                   not (frame_kind == 'B' and frame_id == 0): continue
+            if kind == 'M' and frame_kind == 'O':
+                pending.append(payload)
+                continue
+            callback(''.join(pending) + payload)
+            pending = []
+            if frame_kind in ('O', 'N'): continue
+            if frame_kind == 'B': self.closed = True
+            return ''.join(output)
+
+    def batch(self, lines, callback=None):
+        """Send the commands in list 'lines' as one message and
+        return their output, or pass it to 'callback' a command at a
+        time as with command(). Blank lines are left out."""
+        lines = [line.rstrip('\r\n') for line in lines if line.strip()]
+        if not lines: return ''
+        return self.command('\n'.join(lines), 'M', callback=callback)
+
+    ### Server side
+    def readline(self):
+        """Send the output of the last command and return the next
+        command."""
+        if self.framed:
+            # While there is more of a batch to run, more output follows.
+            if self.queued: kind = 'N'
+            else: kind = 'E'
+            self.send_output(kind)
+            pass
+        if self.queued:
+            return self.queued.pop(0) + '\n'
+        line = None
+        if not self.framed:
+            line = self.connection.reader.readline(False)
+            # A client not using frames gets lines.
+            if not line.startswith(self.MARK): return line
+            self.framed = True
+            pass
+        while True:
+            text, kind, self.request_id, payload = self.read_frame(line)
+            line = None
+            if kind == 'M':
+                self.queued = payload.split('\n')
+                return self.queued.pop(0) + '\n'
+            if kind != 'H': return payload + '\n'
+            # Say which of the things offered we'll do.
+            if zlib and 'zlib' in payload.split():
+                self.send_frame('E', self.request_id, 'zlib')
+                self.start_compression()
+            else:
+                self.send_frame('E', self.request_id, '')
+            pass
+
+    def write(self, msg):
+        if self.closed:
+            return
+        elif self.framed:
+            self.output.append(msg)
+            self.output_size += len(msg)
+            if self.output_size >= self.output_threshold:
+                self.send_output()
+        else:
+            self.connection.write(msg)
+
+    def flush(self):
+        """Send the output we have so far as an O frame."""
+        if self.framed and not (self.is_client or self.closed):
+            self.send_output()
+        return
+
+    def send_output(self, kind='O'):
+        """Send the output kept so far as a 'kind' frame for the
+        last command. An empty O frame isn't sent."""
+        if kind == 'O' and not self.output: return
+        self.send_frame(kind, self.request_id, ''.join(self.output))
+        self.output      = []
+        self.output_size = 0
+        return
+
+    def stats(self):
+        """Return a list of lines describing the traffic so far."""
+        if self.compressor:
+            lines = ['Compression: zlib, for messages of %d bytes or more.'
+                     % self.compress_threshold]
+        else:
+            lines = ['Compression: none.']
+        for what, count, wire in (('Sent', self.bytes_sent, self.wire_sent),
+                                  ('Received', self.bytes_received,
+                                   self.wire_received)):
+            if count: ratio = ' (%d%%)' % (100 * wire / count)
+            else: ratio = ''
+            lines.append('%s %d bytes as %d bytes%s.' %
+                         (what, count, wire, ratio))
+        return lines
+
+# end ConnectionFramed
+
+class ConnectionServerShared(ConnectionInterface):
+    """A debugger session that several clients share. One client, the
+    controlling one, gives commands; any number of others observe,
+    seeing the debugger's output as it is written, the commands given
+    and, say, a line trace while the program runs.
+
+    A helper thread waits on the listening connection and all clients
+    with select(), so clients come and go without the debugged
+    program waiting for them. A new client is put in its place by the
+    first thing it sends: a line "observe" makes it an observer;
+    anything else, such as a ConnectionFramed hello, asks for control.
+    If no one has control, on_control(connection) is called with it
+    and should call control() once it is debugging for it; otherwise
+    it is told that someone else has control and is disconnected.
+
+    While a client is in control, this object stands in for the
+    debugger's stdin and stdout. disconnect() ends the session of the
+    controlling client; the observers stay for the next one. close()
+    stops listening and disconnects everyone.
+
+    What observers are sent is queued and sent by the helper thread
+    as they can take it, so a slow observer never holds up the
+    program; one that falls more than max_pending bytes behind is
+    dropped.
+    """
+    OBSERVE = 'observe'
+    max_pending = 1 << 20  # Bytes an observer may fall behind
+
+    def __init__(self, listener, on_control):
+        ConnectionInterface.__init__(self)
+        self.listener   = listener
+        self.on_control = on_control
+        self.controller = None   # ConnectionFramed of the controlling client
+        self.candidate  = None   # A client given to on_control()
+        self.waiting    = []     # Clients that haven't said what they want
+        self.observers  = []
+        self.pending    = {}     # Observer: list of what it hasn't been sent
+        self.pending_size = {}   # Observer: bytes in its pending list
+        self.lock       = threading.Lock()
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        self.running    = False
+
+    def start(self):
+        """Start the helper thread."""
+        self.running = True
+        thread = threading.Thread(target=self.run,
+                                  name='pydb session server')
+        thread.setDaemon(True)
+        thread.start()
+
+    def run(self):
+        listen_sock = self.listener._sock
+        while self.running:
+            self.lock.acquire()
+            clients = self.waiting + self.observers
+            sending = [c for c in self.observers if self.pending.get(c)]
+            self.lock.release()
+            try:
+                ready, writable = select.select(
+                    [listen_sock, self.wakeup_r] + [c.input for c in clients],
+                    [c.output for c in sending], [])[:2]
+            except (select.error, socket.error):
+                # A client went away under us; go round again.
+                continue
+            if not self.running: break
+            if self.wakeup_r in ready:
+                os.read(self.wakeup_r, 512)
+            for client in sending:
+                if client.output in writable: self.send_pending(client)
+                pass
+            if listen_sock in ready:
+                try:
+                    client = self.listener.accept()
+                except ConnectionFailed:
+                    continue
+                self.lock.acquire()
+                self.waiting.append(client)
+                self.lock.release()
+                pass
+            for client in clients:
+                if client.input in ready: self.heard_from(client)
+                pass
+            pass
+        return
+
+    def heard_from(self, client):
+        """'client' has sent something or gone away."""
+        try:
+            if client in self.observers:
+                client.reader.readline()
+                self.lock.acquire()
+                try:
+                    queued = self.queue(client, '*** Only the controlling '
+                                        'client can give commands.\n')
+                finally:
+                    self.lock.release()
+                if not queued: client.disconnect()
+                return
+            data = client.reader.peek()
+            if self.OBSERVE.startswith(data.rstrip('\r\n')) and \
+                   not data.endswith('\n'):
+                # Wait for the rest of the line.
+                return
+            self.lock.acquire()
+            self.waiting.remove(client)
+            self.lock.release()
+            if data.rstrip('\r\n') == self.OBSERVE:
+                client.reader.readline()
+                client.output.setblocking(0)
+                self.lock.acquire()
+                self.observers.append(client)
+                self.lock.release()
+            elif self.controller is None and self.candidate is None:
+                self.candidate = client
+                self.on_control(client)
+            else:
+                self.refuse(client, data)
+        except (ReadError, WriteError):
+            self.drop(client)
+        return
+
+    def refuse(self, client, data):
+        msg = ('Process %d is being debugged from another client; '
+               'say "%s" to watch.\n' % (os.getpid(), self.OBSERVE))
+        if data.startswith(ConnectionFramed.MARK):
+            # Rather than wait for all of its hello to learn its id,
+            # answer with id 0, which a client takes as meant for it.
+            ConnectionFramed(client).send_frame('B', 0, msg)
+        else:
+            client.write(msg)
+        client.disconnect()
+
+    def drop(self, client):
+        self.lock.acquire()
+        self.forget(client)
+        self.lock.release()
+        client.disconnect()
+
+    def forget(self, client):
+        """Stop tracking 'client'. self.lock must be held."""
+        for clients in (self.waiting, self.observers):
+            if client in clients: clients.remove(client)
+        self.pending.pop(client, None)
+        self.pending_size.pop(client, None)
+
+    def queue(self, observer, msg):
+        """Add 'msg' to what 'observer' is to be sent, waking the helper
+        thread if it had nothing to send it. Returns False if that
+        leaves 'observer' too far behind, in which case it has been
+        forgotten and should be disconnected. self.lock must be held."""
+        pending = self.pending.setdefault(observer, [])
+        size = self.pending_size.get(observer, 0) + len(msg)
+        if size > self.max_pending:
+            self.forget(observer)
+            return False
+        pending.append(msg)
+        self.pending_size[observer] = size
+        if len(pending) == 1: os.write(self.wakeup_w, 'x')
+        return True
+
+    def send_pending(self, observer):
+        """Send 'observer' as much of what is pending as it takes
+        without waiting. Run by the helper thread."""
+        self.lock.acquire()
+        try:
+            pending = self.pending.get(observer)
+            if not pending: return
+            data = ''.join(pending)
+            try:
+                sent = observer.output.send(data)
+            except socket.error, e:
+                if e[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    self.forget(observer)
+                    observer.disconnect()
+                    return
+                sent = 0
+            if sent < len(data):
+                self.pending[observer] = [data[sent:]]
+            else:
+                self.pending[observer] = []
+            self.pending_size[observer] = len(data) - sent
+        finally:
+            self.lock.release()
+        return
+
+    def control(self, controller):
+        """Make 'controller', the ConnectionFramed given to on_control,
+        the controlling client."""
+        self.controller = controller
+        self.candidate  = None
+
+    def broadcast(self, msg):
+        """Queue 'msg' for each observer."""
+        self.lock.acquire()
+        try:
+            behind = [observer for observer in list(self.observers)
+                      if not self.queue(observer, msg)]
+        finally:
+            self.lock.release()
+        for observer in behind:
+            observer.disconnect()
+        return
+
+    def readline(self):
+        if self.controller is None:
+            raise ReadError, 'No controlling client'
+        line = self.controller.readline()
+        self.broadcast(line)
+        return line
+
+    def write(self, msg):
+        if self.controller is not None:
+            self.controller.write(msg)
+        self.broadcast(msg)
+
+    def flush(self):
+        return
+
+    def disconnect(self):
+        """End the controlling client's session."""
+        if self.controller is not None:
+            self.controller.disconnect()
+            self.controller = None
+        if self.candidate is not None:
+            self.candidate.disconnect()
+            self.candidate = None
+
+    def close(self):
+        """Stop listening and disconnect everyone."""
+        self.running = False
+        os.write(self.wakeup_w, 'x')
+        self.disconnect()
+        self.lock.acquire()
+        clients = self.waiting + self.observers
+        self.waiting = self.observers = []
+        self.pending = {}
+        self.pending_size = {}
+        self.lock.release()
+        for client in clients:
+            client.disconnect()
+        self.listener.disconnect()
+
+    def stats(self):
+        if self.controller is None: lines = []
+        else: lines = self.controller.stats()
+        lines.append('Observers: %d.' % len(self.observers))
+        return lines
+
+# end ConnectionServerShared
+
 def import_hook(target):
     cls = target[target.rfind('.')+1:]
     target = target[:target.rfind('.')]
@@ -330,6 +1027,8 @@ class ConnectionClientFactory:
     def create(target):
         if target.lower() == 'tcp':
             return ConnectionClientTCP()
+        elif target.lower() == 'unix':
+            return ConnectionClientUnix()
         elif target.lower() == 'serial':
             return ConnectionSerial()
         elif target.lower() == 'fifo':
@@ -347,6 +1046,8 @@ class ConnectionServerFactory:
     def create(target):
         if target.lower() == 'tcp':
             return ConnectionServerTCP()
+        elif target.lower() == 'unix':
+            return ConnectionServerUnix()
         elif target.lower() == 'serial':
             return ConnectionSerial()
         elif target.lower() == 'fifo':
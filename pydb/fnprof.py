@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""Per-function timing collected from function-tracing call and
+return events.
+
+A FunctionProfile keeps one row per code object with the number of
+calls and the wall-clock and CPU time spent in it, both inclusive of
+the functions it calls and exclusive of them. Rows are created the
+first time a code object is called and updated in place after that.
+The table can be written out in the format the pstats module reads.
+"""
+#   Copyright (C) 2009 Rocky Bernstein
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+#    02110-1301 USA.
+
+import marshal, thread, time
+
+# Indices into a row of the table.
+CALLS, PRIM_CALLS, ACTIVE, WALL, WALL_CUM, CPU, CPU_CUM, CALLERS = range(8)
+
+# Indices into an entry of a thread's call stack.
+ROW, CODE, START_WALL, START_CPU, CHILD_WALL, CHILD_CPU = range(6)
+
+def func_label(code):
+    """The (filename, line, name) triple pstats uses for a function."""
+    return (code.co_filename, code.co_firstlineno, code.co_name)
+
+class FunctionProfile:
+
+    """Call counts and inclusive and exclusive wall-clock and CPU time
+    per code object, kept separately for each thread's calls."""
+
+    def __init__(self):
+        self.rows   = {}    # code -> row
+        self.stacks = {}    # thread id -> list of active calls
+        return
+
+    def call(self, frame):
+        """Note that frame has started running."""
+        code = frame.f_code
+        try:
+            row = self.rows[code]
+        except KeyError:
+            row = self.rows[code] = [0, 0, 0, 0.0, 0.0, 0.0, 0.0, {}]
+            pass
+        tid = thread.get_ident()
+        try:
+            stack = self.stacks[tid]
+        except KeyError:
+            stack = self.stacks[tid] = []
+            pass
+        if stack:
+            callers = row[CALLERS]
+            caller  = stack[-1][CODE]
+            callers[caller] = callers.get(caller, 0) + 1
+            pass
+        row[CALLS] += 1
+        if not row[ACTIVE]: row[PRIM_CALLS] += 1
+        row[ACTIVE] += 1
+        stack.append([row, code, time.time(), time.clock(), 0.0, 0.0])
+        return
+
+    def ret(self, frame):
+        """Note that frame has returned. Returns for calls we didn't
+        see start are ignored."""
+        wall, cpu = time.time(), time.clock()
+        stack = self.stacks.get(thread.get_ident())
+        if not stack: return
+        entry = stack[-1]
+        if entry[CODE] is not frame.f_code: return
+        row = entry[ROW]
+        stack.pop()
+        wall_cum = wall - entry[START_WALL]
+        cpu_cum  = cpu - entry[START_CPU]
+        row[WALL] += wall_cum - entry[CHILD_WALL]
+        row[CPU]  += cpu_cum - entry[CHILD_CPU]
+        row[ACTIVE] -= 1
+        if not row[ACTIVE]:
+            # Only the outermost of recursive calls adds to the
+            # inclusive times.
+            row[WALL_CUM] += wall_cum
+            row[CPU_CUM]  += cpu_cum
+            pass
+        if stack:
+            stack[-1][CHILD_WALL] += wall_cum
+            stack[-1][CHILD_CPU]  += cpu_cum
+            pass
+        return
+
+    def top(self, n=10, key=WALL):
+        """Return up to n (code, row) pairs with the largest key column,
+        exclusive wall-clock time by default."""
+        items = [(row[key], code.co_filename, code.co_firstlineno, code)
+                 for code, row in self.rows.items()]
+        items.sort()
+        items.reverse()
+        return [(item[3], self.rows[item[3]]) for item in items[:n]]
+
+    def stats(self):
+        """Return the table as a dictionary in the form pstats uses."""
+        stats = {}
+        labels = {}
+        for code in self.rows.keys():
+            labels[code] = func_label(code)
+        for code, row in self.rows.items():
+            label = labels[code]
+            cc, nc, tt, ct, callers = stats.get(label, (0, 0, 0.0, 0.0, {}))
+            for caller, count in row[CALLERS].items():
+                caller = labels[caller]
+                callers[caller] = callers.get(caller, 0) + count
+            # Different code objects, like lambdas defined on the same
+            # line, can have the same label; their rows are added up.
+            stats[label] = (cc + row[PRIM_CALLS], nc + row[CALLS],
+                            tt + row[WALL], ct + row[WALL_CUM], callers)
+            pass
+        return stats
+
+    def dump(self, filename):
+        """Write the table to filename so that pstats.Stats can load it."""
+        f = open(filename, 'wb')
+        try:
+            marshal.dump(self.stats(), f)
+        finally:
+            f.close()
+            pass
+        return
+    pass
@@ -0,0 +1,469 @@
+# -*- coding: utf-8 -*-
+"""Debugging programs that fork, directly or through multiprocessing.
+
+ForkManager.watch() replaces os.fork with a routine that runs the real
+fork and then sets up the debugger on each side of it according to
+"set follow-fork-mode":
+
+  parent  the child runs without the debugger (the default)
+  child   the parent runs without the debugger
+  both    both are debugged. The child's debugger talks over a
+          Unix-domain socket, in a directory only our user can get
+          into, instead of the terminal. The first time the child
+          stops it tells the parent where the socket is; "inferior"
+          in the parent then connects and passes commands and output
+          back and forth.
+
+A parent that is waiting for its children, as a process pool does,
+never gets back to its prompt. So in mode both a helper thread in the
+parent picks up children as they stop and, when the parent isn't at
+its prompt, switches to them straight away.
+
+multiprocessing starts its processes with os.fork on POSIX systems,
+so worker processes are covered too.
+"""
+#   Copyright (C) 2009 Rocky Bernstein
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+#    02110-1301 USA.
+
+import os, select, sys, tempfile, threading, weakref
+from connection import ConnectionServerUnix, ConnectionClientUnix, \
+     ConnectionFailed, ReadError, WriteError
+
+follow_fork_modes = ('parent', 'child', 'both')
+
+# The real os.fork. ForkManager.watch() replaces os.fork with
+# _fork_watch, which calls this.
+_os_fork = os.fork
+
+# As with signal.signal in sighandler, os.fork is replaced at most
+# once per process and the calls go to the ForkManager of the debugger
+# active now, held by a weak reference.
+_watcher     = None  # weakref to the active ForkManager
+_os_fork_old = None  # os.fork before we replaced it
+
+def _fork_watch():
+    """Replacement for os.fork; see ForkManager.watch."""
+    forkmgr = _watcher and _watcher()
+    if forkmgr is None or not forkmgr.watching: return _os_fork()
+    return forkmgr.fork_watch()
+
+class ChildConnection(ConnectionServerUnix):
+
+    """The connection a child's debugger uses in follow-fork-mode
+    both. The first time the debugger reads or writes we listen on a
+    socket in a new directory of mode 0700, so that no other user can
+    connect and get a debugger prompt, write our pid and the socket's
+    name to reg_fd for the parent to pick up, and wait for the parent
+    to connect. Once it has, the socket and directory are removed."""
+
+    def __init__(self, reg_fd):
+        ConnectionServerUnix.__init__(self)
+        self.reg_fd = reg_fd
+        return
+
+    def wait_for_parent(self):
+        if self.input is not None: return
+        private_dir = tempfile.mkdtemp(prefix='pydb-')
+        path = os.path.join(private_dir, 'child.sock')
+        self.listen(path)
+        os.write(self.reg_fd, '%d %s\n' % (os.getpid(), path))
+        try:
+            self.connect(path)
+        finally:
+            try:
+                os.unlink(path)
+                os.rmdir(private_dir)
+            except OSError:
+                pass
+            pass
+        return
+
+    def readline(self):
+        """Read a command. A lost connection reads as end of file."""
+        self.wait_for_parent()
+        try:
+            return ConnectionServerUnix.readline(self)
+        except ReadError:
+            return ''
+        return # Not reached
+
+    def write(self, msg):
+        self.wait_for_parent()
+        ConnectionServerUnix.write(self, msg)
+        return
+
+    def flush(self):
+        return
+    pass
+
+class Inferior:
+
+    """A process forked from the debugged program in follow-fork-mode
+    both, as seen from the parent."""
+
+    def __init__(self, num, pid):
+        self.num        = num
+        self.pid        = pid
+        self.path       = None   # Its socket, once the child has stopped
+        self.connection = None   # Set once we've switched to it
+        self.running    = False  # Left running when we switched away?
+        self.exited     = False
+        return
+
+    def state(self):
+        if self.exited:
+            return 'exited'
+        try:
+            os.kill(self.pid, 0)
+        except OSError:
+            self.exited = True
+            return 'exited'
+        if self.path is None or self.running:
+            return 'running'
+        return 'stopped'
+    pass
+
+class ForkManager:
+
+    """Keeps the follow-fork-mode setting and the list of forked
+    processes for debugger pydb."""
+
+    def __init__(self, pydb):
+        self.pydb         = pydb
+        self.mode         = 'parent'
+        self.inferiors    = []     # list of Inferior
+        self.reg_r        = None   # pipe children register on
+        self.reg_w        = None
+        self.reg_data     = ''     # partial registration line read
+        self.lock         = threading.Lock()   # for reading reg_r
+        self.tty_lock     = threading.RLock()  # held while at a prompt
+        self.watcher      = None   # thread picking up stopped children
+        self.watching     = False  # Do we get the calls to os.fork?
+        self.prev_watcher = None   # weakref to the manager active before us
+        return
+
+    def watch(self, on=True):
+        """Start (on=True) or stop (on=False) intercepting calls to
+        os.fork. When we stop, the manager that was watching before we
+        started gets the calls again; if there is none, os.fork is put
+        back."""
+        global _watcher, _os_fork_old
+        if on:
+            if self.watching: return
+            self.watching     = True
+            self.prev_watcher = _watcher
+            _watcher          = weakref.ref(self)
+            if _os_fork_old is None:
+                _os_fork_old = os.fork
+                os.fork      = _fork_watch
+                pass
+            return
+        if not self.watching: return
+        self.watching = False
+        if _watcher is None or _watcher() is not self: return
+        prev = self.prev_watcher
+        self.prev_watcher = None
+        while prev is not None:
+            forkmgr = prev()
+            if forkmgr is None: prev = None
+            elif forkmgr.watching: break
+            else: prev = forkmgr.prev_watcher
+            pass
+        _watcher = prev
+        # As with signal.signal in sighandler, leave a wrapper
+        # installed after ours alone.
+        if prev is None and os.fork == _fork_watch:
+            os.fork      = _os_fork_old
+            _os_fork_old = None
+            pass
+        return
+
+    def fork_watch(self):
+        """os.fork, as seen by the program while we watch."""
+        pydb = self.pydb
+        pydb.flush_output()
+        if self.mode == 'both' and self.reg_r is None:
+            self.reg_r, self.reg_w = os.pipe()
+            pass
+        pid = _os_fork()
+        if pid == 0:
+            if self.mode == 'parent':
+                self.untrace()
+            elif self.mode == 'both':
+                self.become_child()
+                pass
+        else:
+            if self.mode == 'child':
+                self.untrace()
+            elif self.mode == 'both':
+                self.inferiors.append(Inferior(len(self.inferiors)+2, pid))
+                if self.watcher is None:
+                    self.watcher = threading.Thread(
+                        target=self.watch_children,
+                        name='pydb fork watcher')
+                    self.watcher.setDaemon(True)
+                    self.watcher.start()
+                    pass
+                pass
+            pass
+        return pid
+
+    def untrace(self):
+        """Let this process run on without the debugger."""
+        sys.settrace(None)
+        sys.setprofile(None)
+        threading.settrace(None)
+        self.pydb._user_requested_quit = True
+        self.pydb.noninteractive       = True
+        self.inferiors = []
+        return
+
+    def become_child(self):
+        """Set up the debugger of a child process in mode both."""
+        pydb = self.pydb
+        os.close(self.reg_r)
+        conn = ChildConnection(self.reg_w)
+        self.inferiors  = []
+        self.reg_r      = self.reg_w = None
+        self.reg_data   = ''
+        # Our parent's helper thread isn't here, but its locks may
+        # have been copied while held.
+        self.lock       = threading.Lock()
+        self.tty_lock   = threading.RLock()
+        self.watcher    = None
+        pydb.connection   = conn
+        pydb.use_rawinput = False
+        pydb.target       = 'remote-child'
+        pydb._rebind_input(conn)
+        pydb._rebind_output(conn)
+        # When the program finishes, don't start it over in here.
+        pydb._user_requested_quit = True
+        return
+
+    def poll(self, timeout=0):
+        """Pick up registrations from children that have stopped,
+        waiting up to timeout seconds for one. Returns the inferiors
+        that have registered."""
+        if self.reg_r is None: return []
+        self.lock.acquire()
+        try:
+            while select.select([self.reg_r], [], [], timeout)[0]:
+                data = os.read(self.reg_r, 512)
+                if not data: break
+                self.reg_data += data
+                timeout = 0
+                pass
+            registered = []
+            while '\n' in self.reg_data:
+                line, self.reg_data = self.reg_data.split('\n', 1)
+                try:
+                    pid, path = line.split(' ', 1)
+                    pid = int(pid)
+                except ValueError:
+                    continue
+                for inferior in self.inferiors:
+                    if inferior.pid == pid:
+                        inferior.path = path
+                        registered.append(inferior)
+                        break
+                    pass
+                pass
+        finally:
+            self.lock.release()
+            pass
+        return registered
+
+    def watch_children(self):
+        """Run in a helper thread of the parent in mode both. When a
+        child stops while the parent isn't at its prompt, switch to
+        it."""
+        while self.reg_r is not None:
+            for inferior in self.poll(0.5):
+                if not self.tty_lock.acquire(False):
+                    # We're at the prompt. "info inferiors" shows it.
+                    continue
+                try:
+                    self.pydb.msg('[Process %d has stopped]'
+                                  % inferior.pid)
+                    self.follow(inferior.num)
+                    self.pydb.msg('[Process %d is running]' % os.getpid())
+                    self.pydb.flush_output()
+                finally:
+                    self.tty_lock.release()
+                    pass
+                pass
+            pass
+        return
+
+    def enter_prompt(self):
+        """Called before the debugger reads commands in this process.
+        Waits while the helper thread is passing commands to a
+        child."""
+        self.tty_lock.acquire()
+        return
+
+    def leave_prompt(self):
+        self.tty_lock.release()
+        return
+
+    def lookup(self, num):
+        for inferior in self.inferiors:
+            if inferior.num == num: return inferior
+            pass
+        return None
+
+    def info_inferiors(self, args):
+        """Forked processes being debugged.
+
+List the processes forked under "set follow-fork-mode both" with the
+number "inferior" uses for each and whether they are running, stopped
+or have exited."""
+        pydb = self.pydb
+        self.poll()
+        pydb.msg("  Num  Process  State")
+        pydb.msg("* %-4d %-8d %s" % (1, os.getpid(), 'current'))
+        for inferior in self.inferiors:
+            pydb.msg("  %-4d %-8d %s" % (inferior.num, inferior.pid,
+                                         inferior.state()))
+            pass
+        return False
+
+    def follow(self, num):
+        """Switch to inferior num and then to other inferiors as
+        asked until asked to go back to this process."""
+        while num is not None and num != 1:
+            line = self.switch(num)
+            if line is None: break
+            words = line.split()
+            if len(words) < 2: break
+            num = self.pydb.get_an_int(words[1],
+                                       "inferior: %s is not a number"
+                                       % words[1], min_value=1)
+            pass
+        return
+
+    def read_command(self):
+        """Read a line typed to the debugger; None on end of file."""
+        pydb = self.pydb
+        if pydb.use_rawinput:
+            try:
+                return raw_input()
+            except EOFError:
+                return None
+            pass
+        line = pydb.stdin.readline()
+        if not line: return None
+        return line.rstrip('\n')
+
+    def is_inferior_command(self, line):
+        words = line.split()
+        return words and len(words[0]) >= 3 \
+               and 'inferior'.startswith(words[0])
+
+    def switch(self, num):
+        """Pass commands to and output from inferior num until the user
+        gives an "inferior" command or end of file. Returns the
+        "inferior" command given or None."""
+        pydb = self.pydb
+        self.poll()
+        inferior = self.lookup(num)
+        if inferior is None:
+            pydb.errmsg('No inferior number %d.' % num)
+            return None
+        if inferior.state() == 'exited':
+            pydb.errmsg('Process %d has exited.' % inferior.pid)
+            return None
+        if inferior.path is None:
+            pydb.errmsg("Process %d hasn't stopped in the debugger yet."
+                        % inferior.pid)
+            return None
+        if inferior.connection is None:
+            inferior.connection = ConnectionClientUnix()
+            try:
+                inferior.connection.connect(inferior.path)
+            except ConnectionFailed, e:
+                pydb.errmsg('Connecting to process %d failed: %s'
+                            % (inferior.pid, e))
+                inferior.connection = None
+                return None
+            inferior.running = True
+            pass
+        pydb.msg('[Switching to process %d]' % inferior.pid)
+        pydb.flush_output()
+        # Lines typed at a terminal can be read while the process is
+        # running; other input is buffered where select() can't see it,
+        # so there we just wait for the prompt.
+        if pydb.use_rawinput:
+            stdin = sys.stdin
+        else:
+            stdin = pydb.stdin
+            pass
+        inputs = [inferior.connection]
+        if hasattr(stdin, 'isatty') and stdin.isatty(): inputs.append(stdin)
+        tail = ''
+        while True:
+            if inferior.running:
+                # Show what it writes until we see its prompt. Only
+                # "inferior" commands can be given in the meantime.
+                try:
+                    if inferior.connection.reader.buffered():
+                        ready = [inferior.connection]
+                    else:
+                        ready = select.select(inputs, [], [])[0]
+                except KeyboardInterrupt:
+                    pydb.msg('')
+                    return None
+                if inferior.connection not in ready:
+                    line = self.read_command()
+                    if line is None:
+                        pydb.msg('')
+                        return None
+                    if self.is_inferior_command(line): return line
+                    pydb.errmsg('Process %d is running; only "inferior" '
+                                'commands can be given.' % inferior.pid)
+                    continue
+                try:
+                    text = inferior.connection.readline()
+                except ReadError:
+                    pydb.msg('[Process %d has gone away]' % inferior.pid)
+                    inferior.connection.disconnect()
+                    inferior.connection = None
+                    inferior.exited     = True
+                    return None
+                pydb.msg_nocr(text)
+                pydb.flush_output()
+                tail = (tail + text)[-len(pydb.prompt):]
+                if tail != pydb.prompt: continue
+                inferior.running = False
+            else:
+                pydb.msg_nocr(pydb.prompt)
+                pydb.flush_output()
+                pass
+            line = self.read_command()
+            if line is None:
+                pydb.msg('')
+                return None
+            if self.is_inferior_command(line): return line
+            try:
+                inferior.connection.write(line + '\n')
+            except WriteError:
+                pass
+            inferior.running = True
+            tail = ''
+            pass
+        return # Not reached
+    pass
@@ -20,7 +20,7 @@ __revision = "$Id: info.py,v 1.16 2009/03/06 09:41:37 rockyb Exp $"
 #    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
 #    02110-1301 USA.
 
-import bdb, fns, inspect, os, pprint, sys
+import bdb, fnprof, fns, inspect, os, pprint, sys, tracerec
 
 # ALB this is a fix for a problem with the new 'with' statement. It seems to
 # work, but I don't know exactly why... (the problem was in self.getval called
@@ -77,9 +77,28 @@ The short command name is L."""
         return False
 
     def info_display(self, arg):
-        """Expressions to display when program stops, with code numbers."""
+        """Expressions to display when program stops, with code numbers.
+Counter breakpoints, which are never stopped at, are also listed with
+their hit counts and the values they have sampled."""
         if not self.display.all():
             self.msg('There are no auto-display expressions now.')
+        counters = [bp for bp in bdb.Breakpoint.bpbynumber
+                    if bp and getattr(bp, 'counter', False)]
+        if counters:
+            self.msg('Counter breakpoints:')
+            self.msg('Num Hits     Where')
+            total = 0
+            for bp in counters:
+                self.msg('%-4d%-9d at %s:%d' %
+                         (bp.number, bp.hits, self.filename(bp.file),
+                          bp.line))
+                for sample in bp.samples:
+                    self.msg('\tsample %s: %s' %
+                             (sample.expr, ', '.join(sample.last())))
+                    pass
+                total += bp.hits
+                pass
+            self.msg('%d hits in all.' % total)
         return False
 
     def info_globals(self, arg):
@@ -141,6 +160,40 @@ The short command name is L."""
         self.msg("\n".join(["%s = %s" % (l, self.filter_local(l))
                             for l in self.curframe.f_locals]))
 
+    def info_profile(self, arg):
+        """Function call counts and times from "set fntrace profile".
+
+info profile [N] shows the N functions, 10 by default, in which the
+most wall-clock time was spent not counting the functions they call.
+For each the number of calls and the wall-clock and CPU time in
+seconds are given, without and with (cum) the functions called."""
+        if self.fnprof is None:
+            self.msg('No function profile; see "set fntrace profile".')
+            return False
+        n = 10
+        if len(arg) > 1:
+            try:
+                n = self.get_pos_int(arg[1], min_value=1,
+                                     cmdname='info profile')
+            except ValueError:
+                return False
+        rows = self.fnprof.top(n)
+        if not rows:
+            self.msg('No calls have been timed.')
+            return False
+        self.msg('%8s %10s %10s %10s %10s  %s' %
+                 ('calls', 'wall', 'wall cum', 'cpu', 'cpu cum', 'function'))
+        for code, row in rows:
+            calls = str(row[fnprof.CALLS])
+            if row[fnprof.PRIM_CALLS] != row[fnprof.CALLS]:
+                calls += '/%d' % row[fnprof.PRIM_CALLS]
+            self.msg('%8s %10.6f %10.6f %10.6f %10.6f  %s (%s:%d)' %
+                     (calls, row[fnprof.WALL], row[fnprof.WALL_CUM],
+                      row[fnprof.CPU], row[fnprof.CPU_CUM], code.co_name,
+                      self.filename(self.canonic(code.co_filename)),
+                      code.co_firstlineno))
+        return False
+
     def info_program(self, arg):
         """Execution status of the program."""
         if not self.curframe:
@@ -168,10 +221,41 @@ The short command name is L."""
             return
         self.msg('Current Python file is %s' %
                  self.filename(self.canonic_filename(self.curframe)))
+        self.msg('Source file name cache: %d hits, %d misses, '
+                 '%d directories listed.' %
+                 (self.canonic_hits, self.canonic_misses,
+                  len(self._dir_entries)))
+        return False
+
+    def info_trace(self, arg):
+        """Recorded line trace events.
+
+info trace [N] shows the last N events, 10 by default, saved by "set
+linetrace record". Each line gives the event number, the time since
+recording started, the event, the location and the thread id."""
+        if self.tracerec is None:
+            self.msg('No line trace has been recorded.')
+            return False
+        last = 10
+        if len(arg) > 1:
+            try:
+                last = self.get_pos_int(arg[1], min_value=1,
+                                        cmdname='info trace')
+            except ValueError:
+                return False
+        rec = self.tracerec
+        for entry in rec.records(last):
+            self.msg(tracerec.format_record(entry, rec.codes, rec.start))
         return False
 
     def info_target(self, args):
-        """Display information about the current target."""
+        """Display information about the current target.
+
+For a remote target, also show whether messages are compressed and
+how many bytes have gone each way, before and after compression."""
         self.msg('target is %s' % self.target)
+        stats = getattr(self.connection, 'stats', None)
+        if stats is not None:
+            for line in stats(): self.msg(line)
         return False
 
@@ -3,7 +3,8 @@ Routines here have to do with the subclassing of bdb.  Defines Python
 debugger Basic Debugger (Bdb) class.  This file could/should probably
 get merged into bdb.py
 """
-import bdb, bytecode, inspect, linecache, time, types
+import bdb, bytecode, fnmatch, inspect, linecache, sys, thread
+import threading, time, types, weakref
 from repr import Repr
 from fns import *
 ## from complete import rl_complete
@@ -11,12 +12,187 @@ from fns import *
 def frame2file(obj, frame):
     return obj.filename(obj.canonic_filename(frame))
 
+def compile_condition(cond):
+    """Compile breakpoint condition string `cond' into a code object
+    suitable for eval(). SyntaxError is raised if cond is not a valid
+    Python expression."""
+    return compile(cond.strip(), '<breakpoint condition>', 'eval')
+
+def condition_code(bp):
+    """Return the compiled condition of breakpoint bp. The code object
+    is cached on bp along with the string it came from, so it is
+    recompiled only when bp.cond has been changed."""
+    cached = getattr(bp, 'cond_code', None)
+    if cached is None or cached[0] is not bp.cond:
+        cached = (bp.cond, compile_condition(bp.cond))
+        bp.cond_code = cached
+        pass
+    return cached[1]
+
+class CounterSample:
+    """An expression evaluated each time a counter breakpoint is hit.
+    The last `size' values are kept in a ring buffer."""
+
+    def __init__(self, expr, size=10):
+        self.expr   = expr
+        self.code   = compile(expr, '<sample expression>', 'eval')
+        self.size   = size
+        self.values = []
+        self.next   = 0   # Where the next value goes once values is full
+        return
+
+    def add(self, frame):
+        """Evaluate the expression in frame and save (the repr of) it."""
+        try:
+            value = _sample_repr.repr(eval(self.code, frame.f_globals,
+                                           frame.f_locals))
+        except:
+            value = '*** %s' % sys.exc_info()[0].__name__
+        if len(self.values) < self.size:
+            self.values.append(value)
+        else:
+            self.values[self.next] = value
+            self.next = (self.next + 1) % self.size
+        return
+
+    def last(self):
+        """Return the saved values, oldest first."""
+        return self.values[self.next:] + self.values[:self.next]
+    pass
+
+class ThreadFilter:
+    """The threads a breakpoint is limited to, given as thread names
+    or shell-style patterns of names such as "worker-*". Whether a
+    thread is one of them is worked out the first time we see its
+    thread ident and remembered along with a weak reference to the
+    thread: once a thread has exited its ident may be reused by another,
+    and its entry is dropped when the thread object goes away."""
+
+    def __init__(self, names):
+        self.names  = names
+        self.idents = {}   # thread ident -> (weakref to thread, matches?)
+        return
+
+    def match(self, ident):
+        """Return True if the thread with ident `ident' is one of ours."""
+        t = threading._active.get(ident)
+        if t is None: return False
+        try:
+            ref, result = self.idents[ident]
+            if ref() is t: return result
+        except KeyError:
+            pass
+        name   = t.getName()
+        result = False
+        for pattern in self.names:
+            if fnmatch.fnmatchcase(name, pattern):
+                result = True
+                break
+            pass
+        def forget(ref, idents=self.idents, ident=ident):
+            # The thread is gone; so should its entry be, unless its
+            # ident has already been reused.
+            entry = idents.get(ident)
+            if entry is not None and entry[0] is ref:
+                idents.pop(ident, None)
+            return
+        self.idents[ident] = (weakref.ref(t, forget), result)
+        return result
+
+    def __str__(self):
+        return ' '.join(self.names)
+    pass
+
+_sample_repr = Repr()
+
+def count_hit(b, frame):
+    """Record a hit on counter breakpoint b. If it has no condition or
+    its condition is true, the hit is ignored if b's ignore count is
+    still running down, and otherwise its hit count is bumped and its
+    sample expressions are evaluated."""
+    if b.cond:
+        try:
+            if not eval(condition_code(b), frame.f_globals, frame.f_locals):
+                return
+        except:
+            return
+        pass
+    if b.ignore > 0:
+        b.ignore -= 1
+        return
+    b.hits += 1
+    for sample in b.samples:
+        sample.add(frame)
+        pass
+    return
+
+def effective(filename, lineno, frame):
+    """This routine is a copy of bdb.py's effective(), except that
+    a condition is evaluated from its cached code object rather than
+    parsed again from the string on every hit.
+
+    Counter breakpoints (see count_hit) are also handled here.
+
+    Return (active breakpoint, delete temporary flag) or (None, None) as
+    breakpoint to act upon."""
+    possibles = bdb.Breakpoint.bplist[filename, lineno]
+    for b in possibles:
+        if not b.enabled:
+            continue
+        if not bdb.checkfuncname(b, frame):
+            continue
+        threads = getattr(b, 'threads', None)
+        if threads is not None and not threads.match(thread.get_ident()):
+            continue
+        if getattr(b, 'counter', False):
+            # Counter breakpoints never stop, but there may be others
+            # on this line that do.
+            count_hit(b, frame)
+            continue
+        # Count every hit when bp is enabled
+        b.hits += 1
+        if not b.cond:
+            # If unconditional, and ignoring, go on to next, else
+            # break
+            if b.ignore > 0:
+                b.ignore -= 1
+                continue
+            else:
+                # breakpoint and marker that's ok to delete if
+                # temporary
+                return (b, 1)
+        else:
+            # Conditional bp.
+            # Ignore count applies only to those bpt hits where the
+            # condition evaluates to true.
+            try:
+                val = eval(condition_code(b), frame.f_globals,
+                           frame.f_locals)
+                if val:
+                    if b.ignore > 0:
+                        b.ignore -= 1
+                        # continue
+                    else:
+                        return (b, 1)
+                # else:
+                #   continue
+            except:
+                # if eval fails, most conservative thing is to stop
+                # on breakpoint regardless of ignore count.  Don't
+                # delete temporary, as another hint to user.
+                return (b, 0)
+    return (None, None)
+
 class Bdb(bdb.Bdb):
 
     # Additional levels call frames usually on the stack.
     # Perhaps should be an instance variable?
     extra_call_frames = 7  # Yes, it's really that many!
 
+    # Code objects the breakpoint index holds before it is dropped
+    # and started again.
+    break_index_size  = 10000
+
     def __init__(self):
         bdb.Bdb.__init__(self)
 
@@ -44,6 +220,56 @@ class Bdb(bdb.Bdb):
 
         # Do we want to show/stop at def statements before they are run?
         self.deftrace         = False
+
+        # Breakpoint index: break_index_key() of a code object ->
+        # set of line numbers inside that code which have an enabled
+        # breakpoint. Entries are filled in the first time a code
+        # object is seen and the whole index is dropped (see
+        # reset_break_index) whenever a breakpoint is set, deleted,
+        # enabled or disabled, or it grows past break_index_size.
+        self._code_brkpts     = {}
+
+        # Breakpoint index by thread: thread ident ->
+        # break_index_key() -> the lines from _code_brkpts whose
+        # breakpoints aren't all limited to other threads. See
+        # thread_break_lines.
+        self._thread_brkpts   = {}
+
+        # Caches used by canonic() to find source files without
+        # probing the file system for each new filename:
+        # _dir_entries maps a directory to its modification time and
+        # a dictionary of the names in it, each to whether it is a
+        # file or None if we haven't looked; _real_dirs maps a
+        # directory to its os.path.realpath; and _search_dirs is the
+        # source search path made absolute. reset_source_cache()
+        # drops them.
+        self._dir_entries     = {}
+        self._real_dirs       = {}
+        self._search_dirs     = None
+        self._search_key      = None
+        self._canonic_notfound = set() # filenames canonic() couldn't find
+        self.canonic_hits     = 0
+        self.canonic_misses   = 0
+
+        # The stack last built by get_stack, a map from id() of each
+        # frame in it to its position, and the botframe it was built
+        # with. A new stack shares the older frames with it, so only
+        # the frames that have changed need to be walked.
+        self._stack_cache     = None
+        self._stack_pos       = {}
+        self._stack_bot       = None
+
+        # The most recent frame seen by user_call or user_return and
+        # its depth (see frame_depth).
+        self._depth_frame     = None
+        self._depth           = 0
+
+        # When function tracing is all that needs trace events, calls
+        # and returns come from a sys.setprofile hook rather than
+        # sys.settrace so that lines aren't traced. See
+        # set_fntrace_hook.
+        self.fntrace_hooked   = False
+        self._fntrace_hook_frame = None
         return
 
     def __print_call_params(self, frame):
@@ -63,6 +289,9 @@ class Bdb(bdb.Bdb):
 
     def __print_location_if_trace(self, frame, include_fntrace=True):
         if self.linetrace or (self.fntrace and include_fntrace):
+            if self.linetrace_record:
+                self.tracerec.record(frame)
+                return
             self.setup(frame)
             self.print_location(print_line=True)
             self.display.display(self.curframe)
@@ -138,10 +367,21 @@ class Bdb(bdb.Bdb):
             disp = disp + 'y  '
         else:
             disp = disp + 'n  '
-        self.msg('%-4dbreakpoint    %s at %s:%d' %
-                 (bp.number, disp, self.filename(bp.file), bp.line), out)
+        counter = getattr(bp, 'counter', False)
+        if counter:
+            bptype = 'counter'
+        else:
+            bptype = 'breakpoint'
+        self.msg('%-4d%-14s%s at %s:%d' %
+                 (bp.number, bptype, disp, self.filename(bp.file), bp.line),
+                 out)
         if bp.cond:
-            self.msg('\tstop only if %s' % (bp.cond))
+            if counter:
+                self.msg('\tcount only if %s' % (bp.cond), out)
+            else:
+                self.msg('\tstop only if %s' % (bp.cond), out)
+        if getattr(bp, 'threads', None) is not None:
+            self.msg('\tonly in thread %s' % bp.threads, out)
         if bp.ignore:
             self.msg('\tignore next %d hits' % (bp.ignore), out)
         if (bp.hits):
@@ -149,6 +389,10 @@ class Bdb(bdb.Bdb):
             else: ss = ''
             self.msg('\tbreakpoint already hit %d time%s' %
                      (bp.hits, ss), out)
+        if counter:
+            for sample in bp.samples:
+                self.msg('\tsample %s: %s' %
+                         (sample.expr, ', '.join(sample.last())), out)
         return
 
     def output_break_commands(self):
@@ -163,13 +407,25 @@ class Bdb(bdb.Bdb):
             if bp:
                 bp_no += 1
                 if bp.cond: 
-                    condition = bp.cond
+                    condition = ', %s' % bp.cond
                 else:
                     condition = ''
-                out.append("break %s:%s%s" % 
-                           (self.filename(bp.file), bp.line, condition))
+                if getattr(bp, 'counter', False):
+                    command = 'cbreak'
+                else:
+                    command = 'break'
+                threads = getattr(bp, 'threads', None)
+                if threads is not None:
+                    threads = ' thread %s' % threads
+                else:
+                    threads = ''
+                out.append("%s %s:%s%s%s" % 
+                           (command, self.filename(bp.file), bp.line,
+                            threads, condition))
                 if not bp.enabled:
                     out.append("disable %s" % bp_no)
+                for sample in getattr(bp, 'samples', []):
+                    out.append("sample %s %s" % (bp_no, sample.expr))
         return out
 
     def break_here(self, frame):
@@ -177,26 +433,30 @@ class Bdb(bdb.Bdb):
         calls clear gdb calls delete and gdb's clear command is different.
         I tried saving/restoring method names, but that didn't catch
         all of the places break_here was called.
+
+        The breakpoint index is consulted first so the common case of
+        no breakpoint on this line is a couple of dictionary lookups.
         """
-        filename = self.canonic(frame.f_code.co_filename)
-        if not filename in self.breaks:
+        code = frame.f_code
+        try:
+            lines = self._code_brkpts[self.break_index_key(code)]
+        except KeyError:
+            lines = self.break_lines(code)
+        if not lines:
             return False
         lineno = frame.f_lineno
-        if not lineno in self.breaks[filename]:
+        if not lineno in lines:
             # The line itself has no breakpoint, but maybe the line is the
             # first line of a function with breakpoint set by function name.
-            lineno = frame.f_code.co_firstlineno
-            if not lineno in self.breaks[filename]:
+            lineno = code.co_firstlineno
+            if not lineno in lines:
                 return False
+        filename = self.canonic(code.co_filename)
 
         # flag says ok to delete temp. bp
-        (bp, flag) = bdb.effective(filename, lineno, frame)
+        (bp, flag) = effective(filename, lineno, frame)
         if bp:
-            ## This is new when we have thread debugging.
             self.currentbp = bp.number
-            if hasattr(bp, 'thread_name') and hasattr(self, 'thread_name') \
-                   and bp.thread_name != self.thread_name:
-                    return False
             if (flag and bp.temporary):
                 #### ARG. All for the below name change.
                 self.do_delete(str(bp.number))
@@ -205,6 +465,82 @@ class Bdb(bdb.Bdb):
             return True
         return False
 
+    def break_index_key(self, code):
+        """Return the key of code object `code' in the breakpoint
+        index: all that break_lines looks at, so that the index doesn't
+        keep code objects alive. (They can't be weakly referenced.)"""
+        return (code.co_filename, code.co_firstlineno, code.co_lnotab)
+
+    def break_in_code(self, code):
+        """Return True if there is an enabled breakpoint somewhere
+        within the lines spanned by code object `code'."""
+        return len(self.break_lines(code)) > 0
+
+    def break_lines(self, code):
+        """Return the set of line numbers inside code object `code'
+        that have an enabled breakpoint. The result is cached in the
+        breakpoint index so only the first call for each code object
+        pays for filename canonicalization."""
+        key = self.break_index_key(code)
+        try:
+            return self._code_brkpts[key]
+        except KeyError:
+            pass
+        lines = set()
+        if self.breaks:
+            filename = self.canonic(code.co_filename)
+            if filename in self.breaks:
+                first, last = bytecode.code_line_range(code)
+                for lineno in self.breaks[filename]:
+                    if not first <= lineno <= last: continue
+                    for bp in bdb.Breakpoint.bplist.get((filename, lineno),
+                                                        []):
+                        if bp.enabled:
+                            lines.add(lineno)
+                            break
+                        pass
+                    pass
+                pass
+            pass
+        if len(self._code_brkpts) >= self.break_index_size:
+            self._code_brkpts.clear()
+        self._code_brkpts[key] = lines
+        return lines
+
+    def thread_break_lines(self, code, ident):
+        """Like break_lines, but leave out lines where every enabled
+        breakpoint is limited to threads other than the one with
+        thread ident `ident'."""
+        try:
+            by_code = self._thread_brkpts[ident]
+        except KeyError:
+            by_code = self._thread_brkpts[ident] = {}
+            pass
+        key = self.break_index_key(code)
+        try:
+            return by_code[key]
+        except KeyError:
+            pass
+        lines = self.break_lines(code)
+        if lines:
+            filename = self.canonic(code.co_filename)
+            keep = set()
+            for lineno in lines:
+                for bp in bdb.Breakpoint.bplist.get((filename, lineno), []):
+                    threads = getattr(bp, 'threads', None)
+                    if bp.enabled and (threads is None
+                                       or threads.match(ident)):
+                        keep.add(lineno)
+                        break
+                    pass
+                pass
+            lines = keep
+            pass
+        if len(by_code) >= self.break_index_size:
+            by_code.clear()
+        by_code[key] = lines
+        return lines
+
     def canonic(self, filename):
 
         """ Overrides bdb canonic. We need to ensure the file
@@ -213,31 +549,47 @@ class Bdb(bdb.Bdb):
         if filename == "<" + filename[1:-1] + ">":
             return filename
         canonic = self.fncache.get(filename)
-        if not canonic:
-            lead_dir = filename.split(os.sep)[0]
-            if lead_dir == os.curdir or lead_dir == os.pardir:
-                # We may have invoked the program from a directory
-                # other than where the program resides. filename is
-                # relative to where the program resides. So make sure
-                # to use that.
-                canonic = os.path.abspath(os.path.join(self.main_dirname,
-                                                       filename))
-            else:
-                canonic = os.path.abspath(filename)
-            if not os.path.isfile(canonic):
-                canonic = search_file(filename, self.search_path,
-                                      self.main_dirname)
-                # Not if this is right for utter failure.
-                if not canonic: canonic = filename
-            canonic = os.path.realpath(os.path.normcase(canonic))
-            self.fncache[filename] = canonic
+        if canonic:
+            self.canonic_hits += 1
             return canonic
+        self.canonic_misses += 1
+        lead_dir = filename.split(os.sep)[0]
+        if lead_dir == os.curdir or lead_dir == os.pardir:
+            # We may have invoked the program from a directory
+            # other than where the program resides. filename is
+            # relative to where the program resides. So make sure
+            # to use that.
+            canonic = os.path.abspath(os.path.join(self.main_dirname,
+                                                   filename))
+        else:
+            canonic = os.path.abspath(filename)
+        if not self.isfile_cached(canonic):
+            canonic = self.search_source(filename)
+            # Not if this is right for utter failure.
+            if not canonic:
+                canonic = filename
+                self._canonic_notfound.add(filename)
+        canonic = self.realpath_cached(os.path.normcase(canonic))
+        self.fncache[filename] = canonic
         return canonic
 
     def canonic_filename(self, frame):
         return self.canonic(frame.f_code.co_filename)
 
+    def clear_all_breaks(self):
+        self.reset_break_index()
+        return bdb.Bdb.clear_all_breaks(self)
+
+    def clear_all_file_breaks(self, filename):
+        self.reset_break_index()
+        return bdb.Bdb.clear_all_file_breaks(self, filename)
+
+    def clear_bpbynumber(self, arg):
+        self.reset_break_index()
+        return bdb.Bdb.clear_bpbynumber(self, arg)
+
     def clear_break(self, filename, lineno):
+        self.reset_break_index()
         filename = self.canonic(filename)
         if not filename in self.breaks:
             self.errmsg('No breakpoint at %s:%d.'
@@ -289,6 +641,166 @@ class Bdb(bdb.Bdb):
             return(os.path.basename(filename))
         return filename
 
+    def fntrace_only(self):
+        """Return True if function tracing is the only thing that
+        needs trace events: no line tracing, no breakpoints and no
+        stepping, "next" or "finish" in progress."""
+        return (self.fntrace and not self.linetrace and not self.breaks
+                and self.stopframe is None and self.returnframe is None
+                and (self.step_ignore < 0 or not self.stepping)
+                and getattr(self, 'traced', None) is None)
+
+    def fntrace_dispatch(self, frame, event, arg):
+        """sys.setprofile hook used in place of trace_dispatch while
+        fntrace_only() holds. Only calls and returns come here."""
+        if event == 'call':
+            if frame is self._fntrace_hook_frame:
+                # Already seen by trace_dispatch when we switched over.
+                self._fntrace_hook_frame = None
+                return
+            self.dispatch_call(frame, arg)
+        elif event == 'return':
+            self.dispatch_return(frame, arg)
+            if frame is self.botframe:
+                self.clear_fntrace_hook()
+                pass
+            pass
+        return
+
+    def set_fntrace_hook(self, frame):
+        """Switch from line tracing to getting just calls and returns
+        through fntrace_dispatch. frame is the frame whose call event
+        is being handled."""
+        sys.settrace(None)
+        f = frame.f_back
+        while f is not None:
+            del f.f_trace
+            if f is self.botframe: break
+            f = f.f_back
+            pass
+        self._fntrace_hook_frame = frame
+        self.fntrace_hooked      = True
+        sys.setprofile(self.fntrace_dispatch)
+        return
+
+    def clear_fntrace_hook(self, frame=None):
+        """Undo set_fntrace_hook. If frame is given, line tracing is
+        turned back on for it and the frames that called it."""
+        sys.setprofile(None)
+        self.fntrace_hooked      = False
+        self._fntrace_hook_frame = None
+        if frame is not None:
+            self.trace_callers(frame)
+            sys.settrace(self.trace_dispatch)
+            pass
+        return
+
+    def trace_callers(self, frame):
+        """Give frame and the frames that called it, up to botframe,
+        our local trace function, so that we get line events in them
+        when they are returned to."""
+        f = frame
+        while f is not None:
+            f.f_trace = self.trace_dispatch
+            if f is self.botframe: break
+            f = f.f_back
+            pass
+        return
+
+    def forget_stack_cache(self):
+        """Drop the stack saved by get_stack so that we don't keep
+        frames of the debugged program alive once we've moved on."""
+        self._stack_cache = None
+        self._stack_pos   = {}
+        self._stack_bot   = None
+        return
+
+    def trim_stack_cache(self, frame):
+        """'frame' is returning: drop it, and anything above it, from
+        the stack saved by get_stack. While line tracing we don't
+        stop, so forget_stack_cache isn't called; this keeps the
+        saved stack from holding on to frames that have finished."""
+        n = self._stack_pos.get(id(frame))
+        cache = self._stack_cache
+        if n is None or cache[n][0] is not frame: return
+        for frame_lineno in cache[n:]:
+            del self._stack_pos[id(frame_lineno[0])]
+            pass
+        del cache[n:]
+        return
+
+    def frame_depth(self, frame):
+        """Return the number of frames in frame's f_back chain, as
+        count_frames(frame) would.
+
+        Calls and returns usually happen one level from the frame we
+        saw last, so we remember that frame and its depth: a frame
+        called from it is one deeper, and on return we go back to the
+        caller (see user_return). Otherwise, for example when frames
+        were unwound by an exception without our seeing the return, we
+        count the frames the slow way."""
+        if frame is self._depth_frame:
+            depth = self._depth
+        elif frame.f_back is not None and frame.f_back is self._depth_frame:
+            depth = self._depth + 1
+        else:
+            depth = count_frames(frame)
+        self._depth_frame = frame
+        self._depth       = depth
+        return depth
+
+    def get_stack(self, f, t):
+        """Like bdb's get_stack, but the stack built the last time is
+        reused: we walk back from frame f only until we reach a frame
+        already in it, and then replace the part above that frame.
+        With line tracing of deeply-nested code this saves walking the
+        whole chain of frames on every line.
+
+        A frame below the one joined at hasn't run since the previous
+        stack was built, so its line number is still right; only the
+        joined frame itself needs its line number refreshed.
+        Stacks that include a traceback are always built from scratch.
+
+        The caller gets a copy, which later calls don't change."""
+        cache = self._stack_cache
+        if t is None and cache is not None and self._stack_bot is self.botframe:
+            pos  = self._stack_pos
+            new  = []
+            join = None
+            g    = f
+            while g is not None:
+                n = pos.get(id(g))
+                if n is not None and cache[n][0] is g:
+                    join = n
+                    break
+                new.append((g, g.f_lineno))
+                if g is self.botframe: break
+                g = g.f_back
+                pass
+            if join is not None:
+                for frame_lineno in cache[join+1:]:
+                    del pos[id(frame_lineno[0])]
+                    pass
+                del cache[join+1:]
+                cache[join] = (g, g.f_lineno)
+                new.reverse()
+                for frame_lineno in new:
+                    pos[id(frame_lineno[0])] = len(cache)
+                    cache.append(frame_lineno)
+                    pass
+                return list(cache), max(0, len(cache) - 1)
+            pass
+
+        stack, i = bdb.Bdb.get_stack(self, f, t)
+        if t is None:
+            self._stack_cache = list(stack)
+            self._stack_pos   = dict([(id(stack[n][0]), n)
+                                      for n in range(len(stack))])
+            self._stack_bot   = self.botframe
+        else:
+            self.forget_stack_cache()
+        return stack, i
+
     def format_stack_entry(self, frame_lineno, lprefix=': ',
                            include_location=True):
         """Format and return a stack entry gdb-style.
@@ -355,6 +867,98 @@ class Bdb(bdb.Bdb):
     # The following two methods can be called by clients to use
     # a debugger to debug a statement, given as a string.
 
+    def isfile_cached(self, path):
+        """Like os.path.isfile, but answered from a cached listing of
+        the directory. A name that is in the listing is checked to be
+        a file once. A name that isn't costs a stat of the directory,
+        which is listed again if it has changed since."""
+        dirname, basename = os.path.split(path)
+        try:
+            mtime, entries = self._dir_entries[dirname]
+        except KeyError:
+            mtime, entries = self.list_dir(dirname)
+        else:
+            if basename not in entries:
+                try:
+                    changed = os.stat(dirname).st_mtime != mtime
+                except OSError:
+                    changed = mtime is not None
+                if changed: mtime, entries = self.list_dir(dirname)
+                pass
+            pass
+        if basename not in entries: return False
+        isfile = entries[basename]
+        if isfile is None:
+            isfile = entries[basename] = os.path.isfile(path)
+        return isfile
+
+    def list_dir(self, dirname):
+        """List directory 'dirname' into the cache used by
+        isfile_cached and return its entry there."""
+        try:
+            mtime   = os.stat(dirname).st_mtime
+            entries = dict.fromkeys(os.listdir(dirname))
+        except OSError:
+            mtime, entries = None, {}
+        self._dir_entries[dirname] = mtime, entries
+        return mtime, entries
+
+    def realpath_cached(self, path):
+        """Like os.path.realpath, but the real path of each directory
+        is worked out once; after that only the last part of 'path'
+        is checked for being a symbolic link."""
+        dirname, basename = os.path.split(path)
+        if not basename: return os.path.realpath(path)
+        realdir = self._real_dirs.get(dirname)
+        if realdir is None:
+            realdir = self._real_dirs[dirname] = os.path.realpath(dirname)
+        path = os.path.join(realdir, basename)
+        if os.path.islink(path): return os.path.realpath(path)
+        return path
+
+    def reset_source_cache(self):
+        """Forget cached directory listings and the files canonic()
+        couldn't find. Call this when the working directory or the
+        source search path changes."""
+        self._dir_entries.clear()
+        self._real_dirs.clear()
+        self._search_dirs = None
+        for filename in self._canonic_notfound:
+            if filename in self.fncache: del self.fncache[filename]
+            pass
+        self._canonic_notfound.clear()
+        self.reset_break_index()
+        return
+
+    def search_source(self, filename):
+        """Return a full pathname for filename found along the source
+        search path, or None. This is fns.search_file using the
+        directory listings cached by isfile_cached."""
+        key = (self.search_path[:], self.main_dirname)
+        if self._search_dirs is None or key != self._search_key:
+            self._search_dirs = []
+            for trydir in self.search_path:
+                # Handle $cwd and $cdir
+                if trydir =='$cwd': trydir='.'
+                elif trydir == '$cdir': trydir = self.main_dirname
+                self._search_dirs.append(os.path.abspath(trydir))
+                pass
+            self._search_key = key
+            pass
+        for trydir in self._search_dirs:
+            tryfile = os.path.normpath(os.path.join(trydir, filename))
+            if self.isfile_cached(tryfile):
+                return tryfile
+            pass
+        return None
+
+    def reset_break_index(self):
+        """Drop the breakpoint index. This must be called whenever a
+        breakpoint is added, removed, enabled or disabled."""
+        self._code_brkpts.clear()
+        self._thread_brkpts.clear()
+        return
+
     def run(self, cmd, globals=None, locals=None):
         """A copy of bdb's run but with a local variable added so we
         can find it it a call stack and hide it when desired (which is
@@ -380,6 +984,9 @@ class Bdb(bdb.Bdb):
             self.quitting = 1
             self.running = False
             sys.settrace(None)
+            # Done inline: a call here would be reported to the hook.
+            sys.setprofile(None)
+            self.fntrace_hooked = False
         return
 
     def reset(self):
@@ -387,6 +994,26 @@ class Bdb(bdb.Bdb):
         self.forget()
         return
 
+    def set_break(self, filename, lineno, temporary=0, cond=None,
+                  funcname=None):
+        """Like bdb's set_break, but a condition is compiled here so
+        that a syntax error is reported now rather than when the
+        breakpoint is hit."""
+        if cond:
+            try:
+                code = compile_condition(cond)
+            except SyntaxError, e:
+                return 'Syntax error in condition: %s' % e
+            pass
+        self.reset_break_index()
+        err = bdb.Bdb.set_break(self, filename, lineno, temporary, cond,
+                                funcname)
+        if not err and cond:
+            bp = self.get_breaks(self.canonic(filename), lineno)[-1]
+            bp.cond_code = (bp.cond, code)
+            pass
+        return err
+
     def set_trace(self, frame=None):
         """Wrapper to accomodate different versions of Python"""
         if sys.version_info[0] == 2 and sys.version_info[1] >= 4:
@@ -405,8 +1032,21 @@ class Bdb(bdb.Bdb):
         self.stop_reason = 'call'
         if self._wait_for_mainpyfile:
             return
+        if not self.fntrace_hooked and self.fntrace_only():
+            self.set_fntrace_hook(frame)
         if self.stop_here(frame):
-            frame_count = count_frames(frame, Bdb.extra_call_frames)
+            if self.fntrace and self.fntrace_profile:
+                self.fnprof.call(frame)
+                if not self.linetrace:
+                    if not self.break_here(frame): return
+                    self.interaction(frame, None)
+                    return
+            if self.linetrace_record and (self.linetrace or self.fntrace):
+                self.tracerec.record(frame, 'call')
+                if not self.break_here(frame): return
+                self.interaction(frame, None)
+                return
+            frame_count = self.frame_depth(frame) - Bdb.extra_call_frames
             self.msg_nocr('--%sCall level %d' % 
                           ('-' * (2*frame_count), frame_count))
             if frame_count >= 0:
@@ -415,6 +1055,10 @@ class Bdb(bdb.Bdb):
                 self.msg("")
             if self.linetrace or self.fntrace:
                 self.__print_location_if_trace(frame)
+                if self.fntrace_hooked and not self.fntrace_only():
+                    # A command run while showing the call needs
+                    # line events.
+                    self.clear_fntrace_hook(frame)
                 if not self.break_here(frame): return
             self.interaction(frame, None)
             return
@@ -497,7 +1141,23 @@ class Bdb(bdb.Bdb):
         """This function is called when a return trap is set here."""
         self.stop_reason = 'return'
         frame.f_locals['__return__'] = return_value
-        frame_count = count_frames(frame, Bdb.extra_call_frames)
+        depth = self.frame_depth(frame)
+        # We are about to go back to the caller.
+        self._depth_frame = frame.f_back
+        self._depth       = depth - 1
+        self.trim_stack_cache(frame)
+        if self.fntrace and self.fntrace_profile:
+            self.fnprof.ret(frame)
+            if not self.linetrace:
+                if self.returnframe != None:
+                    self.interaction(frame, None)
+                return
+        if self.linetrace_record and (self.linetrace or self.fntrace):
+            self.tracerec.record(frame, 'return')
+            if self.returnframe != None:
+                self.interaction(frame, None)
+            return
+        frame_count = depth - Bdb.extra_call_frames
         if frame_count >= 0:
             self.msg_nocr("--%sReturn from level %d" % ('-' * (2*frame_count), 
                           frame_count))
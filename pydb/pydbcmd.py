@@ -8,7 +8,7 @@ changed from cmd are here.
 
 $Id: pydbcmd.py,v 1.57 2009/03/18 10:12:54 rockyb Exp $"""
 
-import cmd, linecache, sys, types
+import cmd, linecache, os, sys, time, types
 from fns import *
 
 # Interaction prompt line will separate file and call info from code
@@ -18,6 +18,73 @@ from fns import *
 # line_prefix = ': '    # Use this to get the old situation back
 line_prefix = '\n-> '   # Probably a better default
 
+class OutputBuffer:
+
+    """Collects message fragments destined for an output stream and
+    hands them to the stream's write() a block of whole lines at a
+    time.
+
+    Lines are held until bufsize characters have accumulated or
+    until the oldest of them has waited interval seconds; then
+    everything, a partial last line included, is written. If shared is
+    set (the stream is also the debugged program's stdout or stderr)
+    each completed line is written right away so that debugger and
+    program output stay in order. Otherwise anything after the last
+    newline is kept until the line is completed, the interval is up or
+    flush() is called. Since nothing is written unless something calls
+    in, the owner should check due() now and then; see
+    Cmd.flush_due_output.
+
+    Fragments are separated the way "print >> out, msg," separates
+    them, so output looks the same as it did when written unbuffered."""
+
+    def __init__(self, out, bufsize=4096, interval=0.5, shared=False):
+        self.out       = out
+        self.bufsize   = bufsize
+        self.interval  = interval
+        self.shared    = shared
+        self.pending   = []
+        self.size      = 0
+        self.softspace = False
+        self.held_since = None  # when the oldest pending text came in
+        return
+
+    def due(self, now=None):
+        """Return True if pending text has waited interval seconds."""
+        if not self.pending: return False
+        if now is None: now = time.time()
+        return now - self.held_since >= self.interval
+
+    def write(self, msg):
+        if self.softspace: msg = ' ' + msg
+        self.softspace = not (msg[-1:].isspace() and msg[-1:] != ' ')
+        if not self.pending: self.held_since = time.time()
+        self.pending.append(msg)
+        self.size += len(msg)
+        if self.due():
+            self.flush()
+        elif '\n' in msg and (self.shared or self.size >= self.bufsize):
+            self.flush(whole_lines=True)
+        return
+
+    def flush(self, whole_lines=False):
+        """Write out what has been collected. If whole_lines is set,
+        text after the last newline stays in the buffer."""
+        if not self.pending: return
+        text = ''.join(self.pending)
+        rest = ''
+        if whole_lines:
+            i = text.rfind('\n') + 1
+            text, rest = text[:i], text[i:]
+            pass
+        self.pending   = rest and [rest] or []
+        self.size      = len(rest)
+        if rest: self.held_since = time.time()
+        if text: self.out.write(text)
+        return
+    pass
+
+
 class Cmd(cmd.Cmd):
 
     def __init__(self, completekey='tab', stdin=None, stdout=None):
@@ -31,6 +98,9 @@ class Cmd(cmd.Cmd):
         self.logging_fileobj      = None         # file object from open()
         self.logging_overwrite    = False
         self.logging_redirect     = False
+        self.output_bufsize       = 4096         # see OutputBuffer
+        self.output_interval      = 0.5
+        self._outbufs             = {}           # stream id -> OutputBuffer
         self.nohelp               = 'Undefined command or invalid expression \"%s\".\nType \"help\" for a list of debugger commands.'
         self.prompt               = '(Pydb) '
         self.rcLines              = []
@@ -118,6 +188,7 @@ class Cmd(cmd.Cmd):
             global_vars = None
         try:
             code = compile(line + '\n', '"%s"' % line, 'single')
+            self.flush_output()
             save_stdout = sys.stdout
             save_stdin = sys.stdin
             try:
@@ -403,18 +474,81 @@ See also 'examine' an 'whatis'.
     def msg_nocr(self, msg, out=None):
         """Common routine for reporting messages (no carriage return).
            Derived classed may want to override this to capture output.
+
+           Unless "flush" is set, output is collected into whole lines
+           and written out in blocks; see OutputBuffer and flush_output.
            """
         do_print = True
         if self.logging:
             if self.logging_fileobj is not None:
-                print >> self.logging_fileobj, msg,
-                if self.flush: self.logging_fileobj.flush()
+                self._write(self.logging_fileobj, msg)
             do_print = not self.logging_redirect
         if do_print:
             if out is None:
                 out = self.stdout
+            self._write(out, msg)
+
+    def _write(self, out, msg):
+        if self.flush:
+            if id(out) in self._outbufs: self.flush_output(out)
             print >> out, msg,
-            if self.flush: out.flush()
+            out.flush()
+            return
+        try:
+            outbuf = self._outbufs[id(out)]
+        except KeyError:
+            outbuf = OutputBuffer(out, self.output_bufsize,
+                                  self.output_interval,
+                                  out in (sys.stdout, sys.stderr,
+                                          sys.__stdout__, sys.__stderr__))
+            self._outbufs[id(out)] = outbuf
+            pass
+        if not isinstance(msg, types.StringTypes): msg = str(msg)
+        outbuf.write(msg)
+        return
+
+    def flush_output(self, out=None):
+        """Write out any buffered messages. If out is given, only
+        that stream is flushed; otherwise all of them are. This is
+        done before we prompt for a command, before running Python
+        code and whenever an output stream is changed or closed."""
+        if out is None:
+            outbufs = self._outbufs.values()
+            self._outbufs = {}
+        else:
+            outbufs = [self._outbufs.pop(id(out), None)]
+            pass
+        for outbuf in outbufs:
+            if outbuf is None: continue
+            try:
+                outbuf.flush()
+                outbuf.out.flush()
+            except (IOError, ValueError):
+                # Stream has gone away; nothing we can do about it.
+                pass
+            pass
+        return
+
+    def flush_due_output(self):
+        """Write out messages that have been held longer than
+        output_interval. This is called on trace events so that output
+        isn't held back while the program runs on without the debugger
+        writing anything more."""
+        now = None
+        for outbuf in self._outbufs.values():
+            if not outbuf.pending: continue
+            if now is None: now = time.time()
+            if outbuf.due(now): self.flush_output(outbuf.out)
+            pass
+        return
+
+    def preloop(self):
+        self.flush_output()
+        return
+
+    def postcmd(self, stop, line):
+        self.flush_output()
+        return stop
 
     def precmd(self, line):
         """Method executed just before the command line line is
@@ -528,13 +662,14 @@ See also 'examine' an 'whatis'.
             if hasattr(self, 'local_prompt') and self.local_prompt is not None:
                 self.prompt      = self.local_prompt
                 self.local_prompt = None
-                self.onecmd = lambda x: pydb.Pdb.onecmd(self, x)
+                self.onecmd = lambda x: self.__class__.onecmd(self, x)
         self.target = 'local'
 
     def _rebind_input(self, new_input):
         self.stdin = new_input
 
     def _rebind_output(self, new_output):
+        self.flush_output()
         self.stdout.flush()
         self.stdout = new_output
         if not hasattr(self.stdout, 'flush'):
@@ -542,7 +677,8 @@ See also 'examine' an 'whatis'.
 
     def remote_onecmd(self, line):
         """ All commands in 'line' are sent across this object's connection
-        instance variable.
+        instance variable, a connection.ConnectionFramed. The command
+        goes as a single message; its output is shown as it comes back.
         """
         if not line:
             # Execute the previous command
@@ -553,39 +689,38 @@ See also 'examine' an 'whatis'.
         # a pdbserver. This executes extra code to allow the client and server
         # to quit cleanly.
         if 'quit'.startswith(line):
-            line = 'rquit'
-            self.connection.write(line)
+            self.connection.command('rquit', wait=False)
             # Reset the onecmd method
-            self.onecmd = pydb.Pdb.onecmd
+            self.onecmd = lambda x: self.__class__.onecmd(self, x)
             self.do_rquit(None)
             return
-        if 'detach'.startswith(line):
-            self.connection.write('rdetach')
-            self.do_detach(None)
-        self.connection.write(line)
-        ret = self.connection.readline()
-        if ret == '':
+        if line == 'detach':
+            line = 'rdetach'
+        args = line.split()
+        if len(args) > 1 and args[0] == 'source':
+            # Commands in a file here are run over there in one go.
+            self.remote_source(args[1:])
+            self.lastcmd = line
+            return
+        pieces = []
+        def show(text):
+            pieces.append(text)
+            self.msg_nocr(text)
+            self.flush_output()
+            return
+        from connection import ReadError, WriteError
+        try:
+            self.connection.command(line, callback=show)
+        except (ReadError, WriteError):
             self.errmsg('Connection closed unexpectedly')
-            self.onecmd = lambda x: pydb.Pdb.onecmd(self, x)
+            self.onecmd = lambda x: self.__class__.onecmd(self, x)
             self.do_rquit(None)
-        # The output from the command that we've just sent to the server
-        # is returned along with the prompt of that server. So we keep reading
-        # until we find our prompt.
-        i = 1
-        while ret.find('(Pydb)') != -1:
-            if i == 100:
-                # We're probably _never_ going to get that data and that
-                # connection is probably dead.
-                self.errmsg('Connection died unexpectedly')
-                self.onecmd = pydb.Pdb.onecmd
-                self.do_rquit(None)
-            else:
-                ret += self.connection.readline()
-                i += 1
+            return
 
         # Some 'special' actions must be taken depending on the data returned
+        ret = ''.join(pieces)
         if 'restart_now' in ret:
-            self.connection.write('ACK:restart_now')
+            self.connection.command('ACK:restart_now', wait=False)
             self.errmsg('Pdbserver restarting..')
             # We've acknowledged a restart, which means that a new pdbserver
             # process is started, so we have to connect all over again.
@@ -595,10 +730,48 @@ See also 'examine' an 'whatis'.
             if not self.do_target(self.target_addr):
                 # We cannot trust these variables below to be in a
                 # stable state. i.e. if the pdbserver doesn't come back up.
-                self.onecmd = lambda x: pydb.Pdb.onecmd(self, x)
+                self.onecmd = lambda x: self.__class__.onecmd(self, x)
                 return
-        self.msg_nocr(ret)
         self.lastcmd = line
+        if self.connection.closed:
+            # The server detached or went away.
+            self._disconnect()
+        return
+
+    def remote_source(self, args):
+        """Read debugger commands from a file here and send them to the
+        server in a single message. Their output is shown as it comes
+        back, a command at a time; with -v each command is shown as
+        well."""
+        verbose = len(args) == 2 and args[0] == '-v'
+        filename = os.path.expanduser(args[-1])
+        try:
+            rcFile = open(filename)
+        except IOError, (errno, strerror):
+            self.errmsg("Error opening debugger command file %s: %s"
+                        % (filename, strerror))
+            return
+        lines = [line for line in rcFile.readlines() if line.strip()]
+        rcFile.close()
+        shown = []
+        def show(text):
+            if verbose and len(shown) < len(lines):
+                self.msg('+' + lines[len(shown)].rstrip('\r\n'))
+                pass
+            shown.append(text)
+            self.msg_nocr(text)
+            self.flush_output()
+            return
+        from connection import ReadError, WriteError
+        try:
+            self.connection.batch(lines, show)
+        except (ReadError, WriteError):
+            self.errmsg('Connection closed unexpectedly')
+            self.onecmd = lambda x: self.__class__.onecmd(self, x)
+            self.do_rquit(None)
+            return
+        if self.connection.closed:
+            self._disconnect()
         return
     pass
 
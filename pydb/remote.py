@@ -1,7 +1,9 @@
 """$Id: remote.py,v 1.2 2008/05/29 04:07:05 rockyb Exp $
 Contains all code for remote/out-of-process connections."""
 
+import os, sys, threading
 from gdb import Gdb
+from connection import ConnectionFramed, ReadError, WriteError
 
 class RemoteWrapper(Gdb):
     
@@ -26,12 +28,14 @@ class RemoteWrapper(Gdb):
         # ACK'd by any connected clients
         if self.connection != None:
             self.msg('restart_now\n(Pydb)')
+            self.flush_output()
             line = ""
             while not 'ACK:restart_now' in line:
                 line = self.connection.readline()
             self.do_rquit(None)
         else:
             self.msg("Re exec'ing\n\t%s" % self._sys_argv)
+        self.flush_output()
         import os
         os.execvp(self._sys_argv[0], self._sys_argv)
 
@@ -53,6 +57,149 @@ class RemoteWrapper(Gdb):
 class RemoteWrapperServer(RemoteWrapper):
     def __init__(self, pydb_object):
         RemoteWrapper.__init__(self, pydb_object)
+        self.attached        = False
+        self.pydbserver_addr = None
+        self.session         = None  # A ConnectionServerShared, if any
+        self.saved_hooks     = None  # What release() puts back
+        # Nothing of ours is to be in the program's way until a
+        # client attaches.
+        self.sigmgr.watch(False)
+        self.sigmgr.restore_sighandlers()
+        self.forkmgr.watch(False)
+        self.trace_dispatch_attached = self.trace_dispatch
+        self.trace_dispatch          = self.trace_dispatch_server
+
+    def trace_dispatch_server(self, frame, event, arg):
+        """Our trace function. Once we have detached, a frame keeps
+        the trace function release() gave it rather than getting ours
+        back as the result of the event that detached."""
+        if not self.attached:
+            # A frame release() didn't get to, say in another thread.
+            if getattr(frame.f_trace, 'im_self', None) is self:
+                del frame.f_trace
+            return None
+        result = self.trace_dispatch_attached(frame, event, arg)
+        if self.attached: return result
+        return frame.f_trace
+
+    def attach(self, frame, connection=None):
+        """Start debugging this process, stopping next in 'frame'.
+        Commands come from 'connection' or, if that is None, from a
+        client connecting at self.pydbserver_addr as with
+        "pydbserver". Returns False if we are already attached or no
+        client connected.
+
+        set_trace() must be the last call made here: anything called
+        after it would be stepped into."""
+        if self.attached:
+            if connection is not None:
+                try:
+                    connection.write('Process %d already has a debugger '
+                                     'attached.\n' % os.getpid())
+                except WriteError:
+                    pass
+                connection.disconnect()
+            return False
+        if connection is None:
+            self.do_pydbserver(self.pydbserver_addr)
+            if self.target != 'remote-pydbserver': return False
+        else:
+            self.connection = ConnectionFramed(connection)
+            if self.session is not None:
+                # Others may be watching this session.
+                self.session.control(self.connection)
+                self.connection = self.session
+            self.target     = 'remote-pydbserver'
+            self._rebind_input(self.connection)
+            self._rebind_output(self.connection)
+        self.attached = True
+        self.running  = True
+        self.save_hooks(frame)
+        self.sigmgr.watch(self.sigcheck)
+        self.forkmgr.watch()
+        self.set_trace(frame)
+        return True
+
+    def save_hooks(self, frame):
+        """Note the trace and profile functions the program has, and
+        the trace functions of 'frame' and its callers, for release()
+        to put back."""
+        f_traces = {}
+        while frame is not None:
+            f_traces[id(frame)] = (frame, frame.f_trace)
+            frame = frame.f_back
+            pass
+        self.saved_hooks = (getattr(sys, 'gettrace', lambda: None)(),
+                            getattr(sys, 'getprofile', lambda: None)(),
+                            threading._trace_hook,
+                            threading._profile_hook,
+                            f_traces)
+        return
+
+    def release(self):
+        """Take the debugger out of this process: the trace and profile
+        functions the program had when we attached are put back, our
+        wrappers of os.fork and signal.signal are removed and the
+        program's signal handlers put back."""
+        if self.saved_hooks is None: return
+        trace, profile, thread_trace, thread_profile, f_traces = \
+               self.saved_hooks
+        self.saved_hooks = None
+        sys.settrace(trace)
+        sys.setprofile(profile)
+        threading.settrace(thread_trace)
+        threading.setprofile(thread_profile)
+        self.fntrace_hooked = False
+        frame = sys._getframe()
+        while frame is not None:
+            if getattr(frame.f_trace, 'im_self', None) is self:
+                if id(frame) in f_traces:
+                    frame.f_trace = f_traces[id(frame)][1]
+                else:
+                    del frame.f_trace
+                    pass
+                pass
+            frame = frame.f_back
+            pass
+        self.sigmgr.watch(False)
+        self.sigmgr.restore_sighandlers()
+        self.forkmgr.watch(False)
+        self.attached = False
+        self.running  = False
+
+    def cmdloop(self, intro=None):
+        """Read commands from the client. If the client goes away we
+        detach rather than letting the error reach the program."""
+        try:
+            return RemoteWrapper.cmdloop(self, intro)
+        except (ReadError, WriteError):
+            return self.do_detach(None)
+
+    def do_detach(self, arg):
+        """detach
+
+Stop debugging this process and let it run on as it did before the
+debugger attached: nothing of the debugger is left in the way, so it
+runs just as fast. The connection to the client is closed and a
+client can attach again later. Quitting does the same; use "kill" to
+end the program."""
+        if self.attached:
+            try:
+                self.msg('Detached from process %d.' % os.getpid())
+                self.flush_output()
+            except WriteError:
+                pass
+            pass
+        self._disconnect()
+        self.release()
+        return True
+
+    def do_quit(self, arg):
+        """q(uit) - Detach from this process; see "detach". The
+        program is left running."""
+        if self.attached: return self.do_detach(arg)
+        return RemoteWrapper.do_quit(self, arg)
+    do_q = do_quit
 
     def do_pydbserver(self, args):
         """ Allow a debugger to connect to this session.
@@ -80,10 +227,11 @@ The syntax for this command is,
             return
         if self.connection: self.connection.disconnect()
         from connection import ConnectionServerFactory, ConnectionFailed
-        self.connection = ConnectionServerFactory.create(target)
-        if self.connection is None:
+        connection = ConnectionServerFactory.create(target)
+        if connection is None:
             self.errmsg('Unknown protocol')
             return
+        self.connection = ConnectionFramed(connection)
         try:
             self.msg('Listening on: %s' % comm)
             self.connection.connect(comm)
@@ -101,10 +249,7 @@ The syntax for this command is,
         Control returns to the file being debugged and execution of that
         file continues.
         """
-        self._rebind_input(self.orig_stdin)
-        self._rebind_output(self.orig_stdout)
-
-        self.cmdqueue.append('continue')  # Continue execution
+        return self.do_detach(arg)
 
 class RemoteWrapperClient(RemoteWrapper):
     
@@ -144,28 +289,29 @@ target tcp hostname:port -- Use a remote computer via a socket connection
             return False
         if self.connection: self.connection.disconnect()
         from connection import ConnectionClientFactory, ConnectionFailed
-        self.connection = ConnectionClientFactory.create(target)
+        connection = ConnectionClientFactory.create(target)
+        if connection is None:
+            self.errmsg('Unknown protocol')
+            return False
+        self.connection = ConnectionFramed(connection)
         try:
             self.connection.connect(addr)
+            greeting = self.connection.hello()
         except ConnectionFailed, err:
             self.errmsg("Failed to connect to %s: (%s)" % (addr, err))
             return False
+        except (ReadError, WriteError):
+            self.errmsg('Connection closed unexpectedly')
+            self.connection.disconnect()
+            self.connection = None
+            return False
         # This interpreter no longer interprets commands but sends
-        # them straight across this object's connection to a server.
-        # XXX: In the remote_onecmd method we use the local_prompt string
-        # to find where the end of the message from the server is. We
-        # really need a way to get the prompt from the server for checking
-        # in remote_onecmd, because it may be different to this client's.
+        # them straight across this object's connection to a server,
+        # whose output includes its prompt.
         self.local_prompt = self.prompt
         self.prompt = ""
         self.target_addr = target + " " + addr
-        line = self.connection.readline()
-        if line == '':
-            self.errmsg('Connection closed unexpectedly')
-            self.do_quit(None)
-        while '(Pydb)' not in line:
-            line = self.connection.readline()
-        self.msg_nocr(line)
+        self.msg_nocr(greeting)
         self.onecmd = self.remote_onecmd
         self.target = 'remote-client'
         return True
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""Moving backwards and forwards through a line-trace recording.
+
+A Replay keeps a position in the events saved by a TraceRecorder (see
+tracerec.py) and moves it the way "step", "next" and "continue" move a
+running program. Nothing is re-run; only recorded locations are
+available.
+
+The index used to move around is brought up to date with just the
+events recorded since it was last used. It holds the call depth of
+each event and, for each code object and line, the sorted list of
+events at that line so the next or previous visit to a breakpoint
+line is found by bisection. The code ids of each source file are
+kept too, so breakpoints, which are by file name, are turned into
+code ids and lines without looking at every code recorded.
+"""
+#   Copyright (C) 2009 Rocky Bernstein
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+#    02110-1301 USA.
+
+import array, bisect
+
+class TraceIndex:
+
+    """Call depths and per-line event lists for a TraceRecorder.
+    File names of code objects are put through canonic, if given,
+    before they are indexed."""
+
+    def __init__(self, recorder, canonic=None):
+        self.rec        = recorder
+        self.canonic    = canonic
+        self.file_codes = {}   # canonic file name -> code ids
+        self.ncodes     = 0    # Codes of rec.codes in file_codes
+        self.reset(recorder.first())
+        return
+
+    def reset(self, base):
+        self.base         = base          # event number of depths[0]
+        self.depths       = array.array('i')
+        self.lines        = {}            # (code id, line) -> event numbers
+        self.thread_depth = {}            # thread id -> current depth
+        return
+
+    def update(self):
+        """Index the events recorded since the last update."""
+        rec   = self.rec
+        first = rec.first()
+        nxt   = self.base + len(self.depths)
+        if first > nxt or first - self.base > rec.capacity:
+            # Either events we never saw have been overwritten, or
+            # most of what we hold is for overwritten events.
+            self.reset(first)
+            nxt = first
+            pass
+        # Code ids are never reused, so only new codes need adding.
+        for i in xrange(self.ncodes, len(rec.codes)):
+            filename = rec.codes[i][0]
+            if self.canonic: filename = self.canonic(filename)
+            self.file_codes.setdefault(filename, []).append(i)
+            pass
+        self.ncodes  = len(rec.codes)
+        depths       = self.depths
+        lines        = self.lines
+        thread_depth = self.thread_depth
+        for n in xrange(nxt, rec.count):
+            n, t, tid, i, lineno, event = rec.get(n)
+            depth = thread_depth.get(tid, 0)
+            if event == 'call':
+                depth += 1
+                thread_depth[tid] = depth
+            elif event == 'return':
+                thread_depth[tid] = depth - 1
+            elif event == 'line':
+                key = (i, lineno)
+                if key in lines: lines[key].append(n)
+                else: lines[key] = [n]
+                pass
+            depths.append(depth)
+            pass
+        return
+
+    def depth(self, n):
+        return self.depths[n - self.base]
+
+    def codes_in(self, filename):
+        """Return the ids of the recorded codes from file filename."""
+        return self.file_codes.get(filename, [])
+
+    def find_line(self, keys, n, forward=True):
+        """Return the closest event after n (or before n if forward is
+        False) at one of keys, (code id, line) pairs; None if there is
+        none still recorded."""
+        first = self.rec.first()
+        best  = None
+        for key in keys:
+            events = self.lines.get(key)
+            if not events: continue
+            if forward:
+                j = bisect.bisect_right(events, n)
+                if j < len(events) and (best is None or events[j] < best):
+                    best = events[j]
+            else:
+                j = bisect.bisect_left(events, n) - 1
+                if j >= 0 and events[j] >= first \
+                       and (best is None or events[j] > best):
+                    best = events[j]
+                pass
+            pass
+        return best
+    pass
+
+class Replay:
+
+    """A position in a line-trace recording. canonic is as for
+    TraceIndex."""
+
+    def __init__(self, recorder, canonic=None):
+        self.rec   = recorder
+        self.index = TraceIndex(recorder, canonic)
+        self.pos   = None
+        return
+
+    def current(self):
+        """Bring the index up to date and return the current record,
+        starting at the newest one. None is returned if nothing has
+        been recorded."""
+        self.index.update()
+        if self.rec.count == 0: return None
+        if self.pos is None or self.pos < self.rec.first():
+            self.pos = self.rec.count - 1
+        return self.rec.get(self.pos)
+
+    def step(self, count=1):
+        """Move count events, backwards if count is negative. Returns
+        False if this ran into either end of the recording."""
+        if self.current() is None: return False
+        pos = self.pos + count
+        self.pos = max(self.rec.first(), min(pos, self.rec.count - 1))
+        return self.pos == pos
+
+    def next(self, count=1):
+        """Like step but over calls: move to the count'th line event of
+        the same thread that isn't in a function called from here."""
+        cur = self.current()
+        if cur is None: return False
+        tid   = cur[2]
+        depth = self.index.depth(self.pos)
+        if count >= 0:
+            delta, end = 1, self.rec.count
+        else:
+            delta, end, count = -1, self.rec.first() - 1, -count
+        n = self.pos
+        while count > 0:
+            n += delta
+            if n == end:
+                self.pos = n - delta
+                return False
+            rec = self.rec.get(n)
+            if rec[2] == tid and rec[5] == 'line' \
+                   and self.index.depth(n) <= depth:
+                self.pos = n
+                depth = self.index.depth(n)
+                count -= 1
+                pass
+            pass
+        return True
+
+    def cont(self, keys, forward=True):
+        """Move to the next (or previous) event at one of keys, (code
+        id, line) pairs. If there is none, move to the end (or start)
+        of the recording and return False."""
+        if self.current() is None: return False
+        n = self.index.find_line(keys, self.pos, forward)
+        if n is None:
+            if forward: self.pos = self.rec.count - 1
+            else: self.pos = self.rec.first()
+            return False
+        self.pos = n
+        return True
+    pass
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""A statistical profiler that samples the call stacks of all threads.
+
+A helper thread wakes up every so often, looks at each thread's
+current stack through sys._current_frames() and counts the stack it
+finds. No trace or profile function is installed, so the program runs
+at full speed in between samples.
+
+Debugger frames are left out of the stacks the way
+threadinfo.find_nondebug_frame leaves them out of thread listings, and
+threads stopped at the debugger prompt aren't counted.
+"""
+#   Copyright (C) 2009 Rocky Bernstein
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+#    02110-1301 USA.
+
+import cmd, os, sys, thread, threading, time
+
+# Files whose frames are the debugger's rather than the program's.
+debugger_dir   = os.path.dirname(os.path.abspath(__file__))
+debugger_files = ('bdb.py', 'cmd.py', 'threading.py')
+
+# A thread with this in its stack is sitting at a debugger prompt.
+prompt_code = cmd.Cmd.cmdloop.im_func.func_code
+
+def is_debugger_code(code):
+    """Return True if code is part of the debugger."""
+    filename = code.co_filename
+    if filename.endswith('.pyc') or filename.endswith('.pyo'):
+        filename = filename[:-1]
+    (path, basename) = os.path.split(os.path.abspath(filename))
+    if path == debugger_dir: return True
+    for name in debugger_files:
+        if basename.startswith(name): return True
+    return False
+
+def code_name(code):
+    """Short name of code used in reports."""
+    return '%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename),
+                           code.co_firstlineno)
+
+class StackSampler:
+
+    """Count the stacks of all threads every interval seconds.
+
+    Stacks are kept as tuples of code objects, outermost call first. If
+    keep_debugger is set, debugger frames are kept in them."""
+
+    def __init__(self, interval=0.01, keep_debugger=False):
+        self.interval      = interval
+        self.keep_debugger = keep_debugger
+        self.counts        = {}     # stack -> number of samples
+        self.samples       = 0      # number of times we've looked
+        self.elapsed       = 0.0    # seconds sampled before last start
+        self.start_time    = None
+        self.thread        = None
+        self.running       = False
+        self.skip          = {}     # code -> True if it's left out
+        return
+
+    def sample(self):
+        """Take one sample of every thread other than our own."""
+        me     = thread.get_ident()
+        counts = self.counts
+        skip   = self.skip
+        for thread_id, f in sys._current_frames().items():
+            if thread_id == me: continue
+            stack = []
+            while f is not None:
+                code = f.f_code
+                if code is prompt_code:
+                    stack = None
+                    break
+                try:
+                    skipped = skip[code]
+                except KeyError:
+                    skipped = skip[code] = \
+                        not self.keep_debugger and is_debugger_code(code)
+                    pass
+                if not skipped: stack.append(code)
+                f = f.f_back
+                pass
+            if not stack: continue
+            stack.reverse()
+            stack = tuple(stack)
+            counts[stack] = counts.get(stack, 0) + 1
+            pass
+        self.samples += 1
+        return
+
+    def run(self):
+        while self.running:
+            time.sleep(self.interval)
+            self.sample()
+            pass
+        return
+
+    def start(self):
+        """Start sampling in a helper thread."""
+        if self.running: return
+        self.running    = True
+        self.start_time = time.time()
+        self.thread     = threading.Thread(target=self.run,
+                                           name='pydb stack sampler')
+        self.thread.setDaemon(True)
+        self.thread.start()
+        return
+
+    def stop(self):
+        """Stop sampling. What has been counted is kept."""
+        if not self.running: return
+        self.running = False
+        self.thread.join()
+        self.thread  = None
+        self.elapsed += time.time() - self.start_time
+        return
+
+    def seconds(self):
+        """Total time spent sampling."""
+        if self.running:
+            return self.elapsed + time.time() - self.start_time
+        return self.elapsed
+
+    def collapsed(self):
+        """Return the stacks in "collapsed" form: one line per stack
+        with the function names separated by ';' followed by the
+        number of samples, as used by flame graph tools."""
+        lines = []
+        for stack, count in self.counts.items():
+            lines.append('%s %d' % (';'.join([code_name(code)
+                                              for code in stack]), count))
+            pass
+        lines.sort()
+        return lines
+
+    def tree(self, min_fraction=0.01):
+        """Return the stacks merged into a call tree as lines of text.
+        Each line gives the percentage and number of samples in which
+        a function was called along that path. Paths seen in less
+        than min_fraction of the samples are left out."""
+        root = [0, {}]
+        for stack, count in self.counts.items():
+            node = root
+            node[0] += count
+            for code in stack:
+                node = node[1].setdefault(code, [0, {}])
+                node[0] += count
+                pass
+            pass
+        total = root[0]
+        lines = []
+        if not total: return lines
+        def walk(children, depth):
+            items = [(node[0], code_name(code), node)
+                     for code, node in children.items()]
+            items.sort()
+            items.reverse()
+            for count, name, node in items:
+                if count < min_fraction * total: break
+                lines.append('%5.1f%% %6d %s%s' %
+                             (100.0 * count / total, count,
+                              '  ' * depth, name))
+                walk(node[1], depth + 1)
+                pass
+            return
+        walk(root[1], 0)
+        return lines
+    pass
@@ -1,59 +1,217 @@
 """$Id: server.py,v 1.2 2008/05/29 02:53:01 rockyb Exp $
 Debugger Server code
+
+A program calls setup_server() near its top. After that a debugger
+client can attach to the running program at any time, and others can
+watch:
+
+    python server.py PID
+    python server.py -o PID
+
+Nothing of the debugger is imported until setup_server() is called,
+and until a client attaches the program runs as it would without it:
+a trace or profile function it has, say for coverage, is left alone.
+"detach" in the client puts back the ones there were on attaching.
 """
-from gdb import Gdb
-import sys
-import connection
+import os, sys, tempfile
 
 old_handler = None
 server_addr = None
 
+_server     = None   # the RemoteWrapperServer built by setup_server()
+_pending    = []     # connections waiting for the main thread to attach
+_attach_cb  = None   # _attach_pending as a C function for ctypes
+
+try:
+    import ctypes
+    _add_pending_call = ctypes.pythonapi.Py_AddPendingCall
+    _PendingCall      = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p)
+    _add_pending_call.argtypes = [_PendingCall, ctypes.c_void_p]
+except (ImportError, AttributeError):
+    _add_pending_call = None
+
+def default_socket(pid=None):
+    """The Unix-domain socket setup_server() listens on by default in
+    process 'pid', by default this one."""
+    if pid is None: pid = os.getpid()
+    return os.path.join(tempfile.gettempdir(), 'pydb-%d.sock' % pid)
+
 def setup_server(sig=None, protocol=None, addr=None):
     """Gather the parameters to set up a debugging server.
     This routine should be imported and called near the top of the
     program file.
 
-    When signal "sig" is received, which by default is SIGUSR1,
-    invoke_server() is called and passed the parameters used to setup
-    this server.
+    Protocol "protocol" is used for communication. By default it is
+    "unix", a Unix-domain socket named by "addr", or by
+    default_socket(); "tcp" with an "addr" of host:port works the same
+    way. A helper thread waits there for clients, so a client can
+    attach at any time without a signal being involved or the program
+    waiting. While one client debugs, others can connect to watch;
+    see connection.ConnectionServerShared.
 
-    Protocol "protocol" is used for communication.
+    For other protocols, e.g. "serial", the debugger starts listening
+    at "addr" when signal "sig", by default SIGUSR1, is received, and
+    the program waits for a client to connect.
 
-    If "addr" is specified clients can connect to this server
-    at that address.
+    The debugger object is built here, so that attaching has little
+    to do, but it is left inactive until a client attaches: trace
+    functions, signal handlers and the like are left as they are. If
+    we can't listen at "addr", that is reported on stderr and the
+    program runs on without a server.
     """
     import signal
     if not sig:
         sig = signal.SIGUSR1
 
-    global old_handler
-    old_handler = signal.signal(sig, invoke_server)
-
     if protocol != None:
         proto = protocol
     else:
-        proto = 'connection.ConnectionFIFO'
+        proto = 'unix'
+    if addr == None:
+        addr = default_socket()
 
-    global server_addr
-    if addr != None:
-        server_addr = proto + " " + addr 
-    else:
-        tmp = gettmpdir() + os.path.pathsep + str(os.getpid()) + "pydb"
-        server_addr = proto + " " + tmp
+    listener = None
+    if proto.lower() in ('unix', 'tcp'):
+        from connection import ConnectionServerFactory, ConnectionFailed
+        listener = ConnectionServerFactory.create(proto)
+        try:
+            listener.listen(addr)
+        except ConnectionFailed, e:
+            sys.stderr.write("pydb: can't listen on %s (%s); "
+                             "no debugger server.\n" % (addr, e))
+            return
+        pass
+
+    global server_addr, _server, _attach_cb
+    server_addr = proto + " " + addr
+
+    from remote import RemoteWrapperServer
+    p = RemoteWrapperServer(None)
+    p._sys_argv = list(sys.argv)
+    p.pydbserver_addr = server_addr
+    _server = p
+
+    global old_handler
+    old_handler = signal.signal(sig, invoke_server)
+
+    if listener is not None:
+        from connection import ConnectionServerShared
+        p.session = ConnectionServerShared(listener,
+                                           lambda conn:
+                                               _request_attach(conn, sig))
+        import atexit
+        atexit.register(_close_session, p.session, os.getpid())
+        if _add_pending_call is not None and _attach_cb is None:
+            _attach_cb = _PendingCall(_attach_pending)
+            pass
+        p.session.start()
+        pass
+    return
+
+def _close_session(session, pid):
+    """At exit stop listening, unless we are a forked child."""
+    if os.getpid() == pid: session.close()
+    return
+
+def _request_attach(conn, sig):
+    """Called in the session's helper thread when client 'conn' asks
+    for control: get the main thread to attach for it."""
+    _pending.append(conn)
+    # Py_AddPendingCall has the main thread call _attach_pending
+    # between two bytecodes. Without ctypes we have to fall back
+    # on the signal.
+    if _add_pending_call is None or \
+           _add_pending_call(_attach_cb, None) != 0:
+        os.kill(os.getpid(), sig)
+        pass
+    return
+
+def _attach_pending(arg):
+    """Called in the main thread from the Python interpreter's loop;
+    our caller's frame is the one it was running."""
+    try:
+        conn = _pending.pop(0)
+    except IndexError:
+        return 0
+    _server.attach(sys._getframe(1), conn)
+    return 0
 
 def invoke_server(signum, frame):
     """This function sets up a signal handler, which when it
     traps a signal, starts a debugging server suitable for other
     debugging clients to connect to.
     """
-    p = Gdb()
-    p._sys_argv = list(sys.argv)
-    
-    from remote import RemoteWrapperServer
-    p = RemoteWrapperServer(p)
-    p.do_pydbserver(server_addr)
+    if _pending:
+        _server.attach(frame, _pending.pop(0))
+    elif _server.session is None:
+        _server.attach(frame)
+        pass
+    return
 
-    p.set_trace(frame)
-    
-    import signal
-    signal.signal(signum, old_handler)
+def client_connection(addr):
+    """Return a connection to the debugger server at 'addr', a socket
+    file or a host:port for TCP."""
+    from connection import ConnectionClientTCP, ConnectionClientUnix
+    if ':' in addr and not os.path.exists(addr):
+        conn = ConnectionClientTCP()
+    else:
+        conn = ConnectionClientUnix()
+    conn.connect(addr)
+    return conn
+
+def attach_client(addr):
+    """Attach to the program whose debugger server listens at 'addr'
+    and pass commands to it until it detaches. End of file detaches."""
+    from connection import ConnectionFramed, ReadError, WriteError
+    conn = ConnectionFramed(client_connection(addr))
+    def show(text):
+        sys.stdout.write(text)
+        sys.stdout.flush()
+        return
+    try:
+        sys.stdout.write(conn.hello())
+        while not conn.closed:
+            try:
+                line = raw_input()
+            except EOFError:
+                line = 'detach'
+                pass
+            conn.command(line, callback=show)
+            pass
+    except (ReadError, WriteError):
+        pass
+    conn.disconnect()
+    return
+
+def observe_client(addr):
+    """Watch the debugger session of the program whose debugger server
+    listens at 'addr', showing what the debugger says and the commands
+    given to it, until interrupted or the program exits."""
+    from connection import ConnectionServerShared, ReadError, WriteError
+    conn = client_connection(addr)
+    try:
+        conn.write(ConnectionServerShared.OBSERVE + '\n')
+        while True:
+            sys.stdout.write(conn.readline())
+            sys.stdout.flush()
+            pass
+    except (ReadError, WriteError, KeyboardInterrupt):
+        pass
+    conn.disconnect()
+    return
+
+# When invoked as main program, attach to the process or socket given
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    observe = args[:1] == ['-o']
+    if observe: args = args[1:]
+    if len(args) != 1:
+        print "usage: %s [-o] {pid|socket|host:port}" % sys.argv[0]
+        sys.exit(1)
+    target = args[0]
+    if target.isdigit():
+        target = default_socket(int(target))
+    if observe:
+        observe_client(target)
+    else:
+        attach_client(target)
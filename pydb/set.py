@@ -20,7 +20,7 @@ __revision__ = "$Id: set.py,v 1.25 2008/12/09 20:06:10 rockyb Exp $"
 #    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
 #    02110-1301 USA.
 
-import inspect, os, re, sighandler, sys
+import fnprof, forkdbg, inspect, os, re, sighandler, sys, tracerec
 
 class SubcmdSet:
 
@@ -148,22 +148,76 @@ debug methods is over-writing one another, then set this."""
             pass
         return
 
+    def set_fastpath(self, args):
+        """Set whether to skip tracing code which has no breakpoints.
+
+When this is on, a function or method is traced line by line only if
+there is a breakpoint set somewhere inside its code, or if we are
+stepping into it. Other code runs without the per-line overhead of the
+debugger. This is useful when debugging a long-running program with
+a few breakpoints set.
+
+Line tracing, function tracing and signal checking done between calls
+are not performed inside code that is skipped. By default this is off."""
+        try:
+            self.fastpath = self.get_onoff(args[1])
+        except ValueError:
+            pass
+        return
+
     def set_flush(self, args):
-        """Set whether we flush output after each write."""
+        """Set whether we flush output after each write.
+
+When off, messages are collected into whole lines and written out in
+blocks: when enough output has accumulated, when some time has passed
+or before the next prompt. When on, each message is written and
+flushed as it is produced."""
         try:
             self.flush = self.get_onoff(args[1])
+            if self.flush: self.flush_output()
         except ValueError:
             pass
         return
 
     def set_fntrace(self, args):
-        """Set function execution tracing"""
+        """Set function execution tracing
+
+Set fntrace {on|off}. Turns function tracing on or off.
+
+Set fntrace profile. Turns function tracing on, but instead of
+showing each call and return, the number of calls and the time spent
+in each function are tallied. "info profile" shows the result and
+"save profile" writes it out for the pstats module. Each "set fntrace
+profile" starts a new tally. "set fntrace on" goes back to showing
+calls."""
+        if len(args) > 1 and args[1] == 'profile':
+            self.fnprof          = fnprof.FunctionProfile()
+            self.fntrace_profile = True
+            self.fntrace         = True
+            return
         try:
             self.fntrace = self.get_onoff(args[1])
+            if self.fntrace: self.fntrace_profile = False
         except ValueError:
             pass
         return
 
+    def set_follow_fork_mode(self, args):
+        """Set which process is debugged after a fork.
+
+Set follow-fork-mode {parent|child|both}. With "parent", the default,
+the forked child runs without the debugger. With "child" the parent
+runs on without the debugger and the child keeps it. With "both",
+both are debugged: a child's debugger waits for us when the child
+first stops, and "inferior" switches to it. "info inferiors" lists
+the children. Processes started by multiprocessing are forked too."""
+        if len(args) < 2 or args[1] not in forkdbg.follow_fork_modes:
+            self.errmsg('Expecting one of: %s.' %
+                        ', '.join(forkdbg.follow_fork_modes))
+            return
+        self.forkmgr.mode = args[1]
+        return
+
     def set_history(self, args):
         """Generic command for setting command history parameters.
 
@@ -210,6 +264,14 @@ Set linetrace delay `delay'. 'delay' is a fixed or floating-point
 number.  This is only meaningful when line tracing is on.  The DELAY
 value sets the time to sleep between printing line-trace output.  This
 might be useful if you are showing output in a front-end.
+
+Set linetrace record [FILE [SIZE]]. Turns line tracing on, but
+instead of printing each line, a small fixed-size record of it is
+saved. If FILE is given, records go to that file, otherwise they are
+kept in memory. Only the last SIZE records are kept. "info trace"
+shows what has been recorded; a recording file can be turned into
+text by running tracerec.py on it. "set linetrace on" goes back to
+printing.
 """
 
         if args[1] == 'delay':
@@ -221,9 +283,34 @@ might be useful if you are showing output in a front-end.
             except ValueError:
                 self.errmsg(("4th argument %s is not a floating-point "
                              + "number") % str(args[2]) )
+        elif args[1] == 'record':
+            filename = None
+            size     = tracerec.DEFAULT_SIZE
+            if len(args) > 2:
+                filename = os.path.expanduser(args[2])
+            if len(args) > 3:
+                try:
+                    size = self.get_pos_int(args[3], min_value=1,
+                                            cmdname='set linetrace record')
+                except ValueError:
+                    return
+            try:
+                recorder = tracerec.TraceRecorder(filename, size)
+            except (IOError, OSError, EnvironmentError), e:
+                self.errmsg("Can't record to %s: %s" % (filename, e))
+                return
+            if self.tracerec is not None:
+                self.tracerec.close()
+            self.tracerec         = recorder
+            self.linetrace_record = True
+            self.linetrace        = True
         else:
             try:
                 self.linetrace = self.get_onoff(args[1])
+                if self.linetrace:
+                    self.linetrace_record = False
+                elif self.tracerec is not None:
+                    self.tracerec.sync()
             except ValueError:
                 pass
         return
@@ -256,6 +343,7 @@ goes both to the console and the log file.
                                               print_error=False)
                 if old_logging and not self.logging \
                        and self.logging_fileobj is not None:
+                    self.flush_output(self.logging_fileobj)
                     self.logging_fileobj.close()
                 if not old_logging and self.logging \
                        and not self.logging_fileobj:
@@ -317,27 +405,41 @@ to do this."""
     def set_sigcheck(self, args):
         """Set signal handler checking/adjusting.
 
-Turning this on causes the debugger to check after every statement
+set sigcheck {on|off}. Turning this on causes the debugger to notice
 whether a signal handler has changed from one of those that is to be
-handled by the debugger. Because this may add a bit of overhead to the
-running of the debugged program, by default it is set off. However if
-you want to ensure that the debugger takes control when a particular
-signal is encountered you should set this on."""
-
+handled by the debugger. Changes made through signal.signal() are seen
+as they happen and handlers are checked again whenever the debugger
+stops. The debugger starts with it on, but the pydb command sets it off
+unless --sigcheck is given. If you want to ensure that the debugger
+takes control when a particular signal is encountered you should set
+this on.
+
+set sigcheck interval `n'. Also poll the signal handlers every `n'
+trace events. This catches handlers changed in ways other than by
+calling signal.signal(), at the cost of tracing every line. 0, the
+default, turns polling off."""
+
+        if args[1] == 'interval':
+            try:
+                self.sigcheck_interval = self.get_pos_int(args[2], 0)
+                self._sigcheck_countdown = self.sigcheck_interval
+            except IndexError:
+                self.errmsg("Need an integer (the 4th parameter)")
+            except ValueError:
+                pass
+            return
         try:
             sigcheck = self.get_onoff(args[1])
             if sigcheck != self.sigcheck:
                 if sigcheck:
                     # Turn on signal checking/adjusting
                     self.sigmgr.check_and_adjust_sighandlers()
-                    self.break_anywhere = self.break_anywhere_gdb
+                    self.sigmgr.watch(True)
                     self.set_continue   = self.set_continue_gdb
-                    self.trace_dispatch = self.trace_dispatch_gdb
                 else:
                     # Turn off signal checking/adjusting
-                    self.break_anywhere = self.break_anywhere_old
+                    self.sigmgr.watch(False)
                     self.set_continue   = self.set_continue_old
-                    self.trace_dispatch = self.trace_dispatch_old
             self.sigcheck = sigcheck
         except ValueError:
             pass
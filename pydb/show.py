@@ -44,10 +44,14 @@ class SubcmdShow:
         return fns.show_onoff(self.deftrace)
     def get_directories(self):
         return str(self.search_path)
+    def get_fastpath(self):
+        return fns.show_onoff(self.fastpath)
     def get_flush(self):
         return fns.show_onoff(self.flush)
     def get_fntrace(self):
         return fns.show_onoff(self.fntrace)
+    def get_follow_fork_mode(self):
+        return self.forkmgr.mode
     def get_interactive(self):
         return fns.show_onoff(not self.noninteractive)
     def get_linetrace(self):
@@ -119,6 +123,11 @@ $cwd in search path means the current working directory.
 $cdir in the path means the compilation directory of the source file."""
         self.msg("Source directories searched:\n\t%s." % self.get_search_path())
 
+    def show_fastpath(self, args):
+        """Show whether we skip tracing code which has no breakpoints."""
+        self.msg("Fast-path dispatch is %s." % self.get_fastpath())
+        return False
+
     def show_flush(self, args):
         """Show whether we flush output after each write."""
         self.msg('Flushing output is "%s".' % self.get_flush())
@@ -127,6 +136,14 @@ $cdir in the path means the compilation directory of the source file."""
     def show_fntrace(self, args):
         "Show the line function status. Can also add 'delay'"
         self.msg("Function tracing is %s." % self.get_fntrace())
+        if self.fntrace and self.fntrace_profile:
+            self.msg("Calls are being timed; see \"info profile\".")
+        return False
+
+    def show_follow_fork_mode(self, args):
+        """Show which process is debugged after a fork."""
+        self.msg('Debugger response to a program call of fork is "%s".'
+                 % self.forkmgr.mode)
         return False
 
     def show_interactive(self, args):
@@ -137,6 +154,12 @@ $cdir in the path means the compilation directory of the source file."""
     def show_linetrace(self, args):
         "Show the line tracing status. Can also add 'delay'"
         self.msg("line tracing is %s." % self.get_linetrace())
+        if self.tracerec is not None:
+            where = self.tracerec.filename or 'memory'
+            if self.linetrace_record:
+                self.msg("Recording line trace to %s." % where)
+            self.msg("%d events recorded to %s; the last %d are kept." %
+                     (self.tracerec.count, where, self.tracerec.capacity))
         return False
 
     def show_listsize(self, args):
@@ -185,6 +208,9 @@ $cdir in the path means the compilation directory of the source file."""
         """Show status of signal checking/adjusting.
 See also set sigcheck."""
         self.msg("sigcheck is %s." % self.get_sigcheck())
+        if self.sigcheck_interval:
+            self.msg("Signal handlers are polled every %d events." %
+                     self.sigcheck_interval)
         return False
 
     def show_target_address(self, arg):
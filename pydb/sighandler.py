@@ -8,7 +8,27 @@ Handles signal handlers within Pydb.
 #         ignore=True, print=False, pass=True
 #     
 #
-import signal, types
+import signal, types, weakref
+
+# The real signal.signal. SignalManager.watch() may replace
+# signal.signal with a routine that notices when the debugged program
+# changes a handler; we need the original to install our own handlers.
+_signal_signal = signal.signal
+
+# signal.signal is replaced at most once per process, by
+# _signal_watch, which passes calls on to the SignalManager of the
+# debugger active now, say a nested one started by "debug". Managers
+# are held by weak references so that a debugger thrown away without
+# quitting isn't kept alive.
+_watcher           = None  # weakref to the active SignalManager
+_signal_signal_old = None  # signal.signal before we replaced it
+
+def _signal_watch(signum, handler):
+    """Replacement for signal.signal; see SignalManager.watch."""
+    sigmgr = _watcher and _watcher()
+    if sigmgr is None or not sigmgr.watching:
+        return (_signal_signal_old or _signal_signal)(signum, handler)
+    return sigmgr.signal_watch(signum, handler)
 
 def YN(bool):
     """Return 'Yes' for True and 'No' for False, and ?? for anything
@@ -139,6 +159,10 @@ class SignalManager:
             pass
         self.sigs    = {}
         self.siglist = [] # List of signals. Dunno why signal doesn't provide.
+
+        # Set while we get the calls to signal.signal; see watch().
+        self.watching      = False
+        self.prev_watcher  = None  # weakref to the manager active before us
     
         # Ignore signal handling initially for these known signals.
         if ignore_list is None:
@@ -194,7 +218,7 @@ class SignalManager:
                 pass
             # set/restore _our_ signal handler
             try:
-                signal.signal(signum, self.sigs[signame].handle)
+                _signal_signal(signum, self.sigs[signame].handle)
             except ValueError:
                 # Probably not in main thread
                 return False
@@ -210,6 +234,83 @@ class SignalManager:
             pass
         return
 
+    def restore_sighandlers(self):
+        """Put back the program's handler for each signal where ours is
+        installed. This is done when the debugger lets go of the
+        program."""
+        for sig_obj in self.sigs.values():
+            signum = getattr(sig_obj, 'signum', None)
+            if not signum: continue
+            try:
+                if signal.getsignal(signum) != sig_obj.handle: continue
+                old_handler = getattr(sig_obj, 'old_handler', None)
+                if old_handler is None: old_handler = signal.SIG_DFL
+                _signal_signal(signum, old_handler)
+            except ValueError:
+                # Probably not in main thread
+                return False
+            pass
+        return True
+
+    def signal_watch(self, signum, handler):
+        """signal.signal, as seen by the program while we watch. The
+        program's handler is installed as usual, and then if it is a
+        signal we are interested in, our handler is put back with
+        the program's saved as the one to pass the signal along to.
+        The value returned is the handler the program would have
+        seen had the debugger not been there."""
+        old_signal = _signal_signal_old or _signal_signal
+        prev_handler = old_signal(signum, handler)
+        if not self.watching: return prev_handler
+        for signame, sig_obj in self.sigs.items():
+            if sig_obj.signum != signum: continue
+            if prev_handler == sig_obj.handle:
+                prev_handler = sig_obj.old_handler
+                pass
+            self.check_and_adjust_sighandler(signame, self.sigs)
+            pass
+        return prev_handler
+
+    def watch(self, on=True):
+        """Start (on=True) or stop (on=False) intercepting calls to
+        signal.signal so that a handler change made by the program is
+        seen as soon as it happens rather than by polling. When we
+        stop, the manager that was watching before we started gets
+        the calls again; if there is none, signal.signal is put back."""
+        global _watcher, _signal_signal_old
+        if on:
+            if self.watching: return
+            self.watching     = True
+            self.prev_watcher = _watcher
+            _watcher          = weakref.ref(self)
+            # Once is enough, even if someone has since wrapped us.
+            if _signal_signal_old is None:
+                _signal_signal_old = signal.signal
+                signal.signal      = _signal_watch
+                pass
+            return
+        if not self.watching: return
+        self.watching = False
+        # If a debugger started after us is still active, it hands
+        # back to us, and we pass the calls on, when it stops.
+        if _watcher is None or _watcher() is not self: return
+        prev = self.prev_watcher
+        self.prev_watcher = None
+        while prev is not None:
+            sigmgr = prev()
+            if sigmgr is None: prev = None
+            elif sigmgr.watching: break
+            else: prev = sigmgr.prev_watcher
+            pass
+        _watcher = prev
+        # If someone has wrapped signal.signal after us, leave things
+        # alone; _signal_watch is then just a pass-through.
+        if prev is None and signal.signal == _signal_watch:
+            signal.signal      = _signal_signal_old
+            _signal_signal_old = None
+            pass
+        return
+
     def is_name_or_number(self, name_num):
         signame = canonic_signame(name_num)
         if signame is None:
@@ -61,6 +61,17 @@ class threadDbg(pydb.Pdb):
         ## self.traceall()
         self.infocmds.add('threads',  self.info_thread,  2, False)
 
+        # In non-stop mode only the thread that stops waits in the
+        # debugger; see set_non_stop.
+        self.non_stop          = False
+        self.step_thread       = None  # id of thread last in the cmdloop
+        self.main_botframe     = None  # botframe before non-stop moved it
+        self.interrupt_request = {}    # thread id -> True if it should stop
+        self.stopped           = {}    # thread id -> True if in dispatcher
+        self.dispatch_gen      = 0     # Odd while threading_lock is held
+        self.setcmds.add('non-stop',  self.set_non_stop,  3)
+        self.showcmds.add('non-stop', self.show_non_stop, 3)
+
     def get_threadframe_frame(self, thread_name):
         """Return the frame having thread name that we look up
         in self.traced."""
@@ -86,12 +97,13 @@ class threadDbg(pydb.Pdb):
         # complicated (if not error prone) that way.
         
         self.threading_cond=threading.Condition(threading.Lock())
+        self.dispatch_gen = 0
         self.threading_imported=True
         self.running=True
         threading.settrace(self.trace_dispatch)
 
-    def do_break(self, arg, temporary=0, thread_name=None):
-        """b(reak) {[file:]lineno | function} [thread Thread-name] [, condition]
+    def do_break(self, arg, temporary=0, threads=None):
+        """b(reak) {[file:]lineno | function} [thread Thread-name...] [, condition]
 With a line number argument, set a break there in the current file.
 With a function name, set a break at first executable line of that
 function.  Without argument, set a breakpoint at current location.  If
@@ -103,24 +115,14 @@ to specify a breakpoint in another file (probably one that
 hasn't been loaded yet).  The file is searched for on sys.path;
 the .py suffix may be omitted.
 
-If a thread name is given we will stop only if the the thread has that name;
-dot (.) can be used to indicate the current thread."""
-        
-        # Decorate non-thread break to strip out 'thread Thread-name'
-        args = arg.split()
-        if len(args) > 2 and args[1] == 'thread':
-            thread_name = args[2]
-            if thread_name == '.':
-                thread_name = threading.currentThread().getName()
-            del args[1:3]
-            arg = ' '.join(args)
-        if thread_name and thread_name not in self.traced.keys():
-            self.errmsg("I don't know about thread %s" % thread_name)
-            if not fns.get_confirmation(self,
-                                        'Really set anyway (y or n)? '):
-                return
+If thread names are given we will stop only in threads with those
+names; dot (.) can be used to indicate the current thread. A name may
+be a shell-style pattern such as worker-* to match a group of threads,
+including ones started later."""
+        arg, threads = self.parse_break_threads(arg, threads)
+        if arg is None: return
         self.nothread_do_break(self, arg, temporary=temporary,
-                               thread_name=thread_name)
+                               threads=threads)
 
     def do_frame(self, arg):
         """frame [thread-Name|thread-number] [frame-number]
@@ -227,39 +229,123 @@ newest frame."""
         if really_quit:
             self.nothread_quit(self, arg)
 
+    def do_interrupt(self, arg):
+        """interrupt {thread-name|thread-number}
+
+In non-stop mode, stop the given thread at the next line it runs. The
+thread stops once the debugger is free, that is after the thread
+now at the prompt is continued; a thread blocked in a system call
+stops after the call returns."""
+        if not self.non_stop:
+            self.errmsg('"interrupt" is used with "set non-stop on".')
+            return
+        args = arg.split()
+        if len(args) != 1:
+            self.errmsg('"interrupt" needs a thread name or number.')
+            return
+        thread_name = args[0]
+        try:
+            thread_id = int(thread_name)
+            if thread_id not in self.traced.values():
+                self.errmsg("I don't know about thread number %s" %
+                            thread_name)
+                return
+        except ValueError:
+            if thread_name not in self.traced.keys():
+                self.errmsg("I don't know about thread %s" % thread_name)
+                return
+            thread_id = self.traced[thread_name]
+        if thread_id == thread.get_ident():
+            self.errmsg("Thread %s is already stopped." % thread_name)
+            return
+        self.interrupt_request[thread_id] = True
+        self.msg("Thread %s will stop at its next line." % thread_name)
+        return
+
     def do_qt(self, arg):
         """Quit the current thread."""
         thread_name=threading.currentThread().getName()
         self.msg( "quitting thread %s"  % thread_name)
         del self.traced[thread_name]
-        self.threading_lock.release()
+        self.unlock_dispatch()
         thread.exit()
 
     def do_tbreak(self, arg):
-        """tbreak {[file:]lineno | function} [thread Thread-name] [, condition]
+        """tbreak {[file:]lineno | function} [thread Thread-name...] [, condition]
 
 Set a temporary breakpoint. Arguments are like the "break" command.
 Like "break" except the breakoint is only temporary,
 so it will be deleted when hit.
 
-If a thread name is given we will stop only if the the thread has that name."""
-        # Decorate non-thread break to strip out 'thread Thread-name'
+If thread names or patterns are given we will stop only in threads
+that match one of them."""
+        arg, threads = self.parse_break_threads(arg)
+        if arg is None: return
+        self.nothread_do_tbreak(self, arg, threads)
+        return
+
+    def parse_break_threads(self, arg, threads=None):
+        """Strip 'thread Thread-name...' out of the arguments to a
+        break command. Returns the remaining arguments and the list of
+        thread names, or threads if none were given. If a name, other
+        than a pattern, isn't a thread we know about and the user
+        doesn't confirm, the arguments returned are None."""
+        comma = arg.find(',')
+        if comma >= 0:
+            condition = arg[comma:]
+            arg = arg[:comma]
+        else:
+            condition = ''
         args = arg.split()
-        thread_name = None
         if len(args) > 2 and args[1] == 'thread':
-            thread_name = args[2]
-            if thread_name == '.':
-                thread_name = threading.currentThread().getName()
-            if thread_name not in self.traced.keys():
-                self.errmsg("I don't know about thread %s" % thread_name)
-                if not fns.get_confirmation(self,
-                                            'Really set anyway (y or n)? '):
-                    return
-            del args[1:3]
-            arg = ' '.join(args)
-        self.nothread_do_tbreak(self, arg, thread_name)
+            threads = []
+            for thread_name in args[2:]:
+                if thread_name == '.':
+                    thread_name = threading.currentThread().getName()
+                threads.append(thread_name)
+                # A pattern may be for threads that haven't started yet.
+                is_pattern = [c for c in '*?[' if c in thread_name]
+                if not is_pattern and thread_name not in self.traced.keys():
+                    self.errmsg("I don't know about thread %s" % thread_name)
+                    if not fns.get_confirmation(self,
+                                                'Really set anyway (y or n)? '):
+                        return None, None
+                    pass
+                pass
+            del args[1:]
+            pass
+        return ' '.join(args) + condition, threads
+
+    def reset(self):
+        pydb.Pdb.reset(self)
+        self.main_botframe = None
+        return
+
+    def set_non_stop(self, args):
+        """Set whether other threads keep running when one stops.
+
+In the default all-stop mode, when a thread stops at a breakpoint or
+after a step, every other thread waits until it is continued. With
+non-stop on, only that thread waits and the rest keep running; they
+stop only at breakpoints or when "interrupt" is used on them. Stepping
+applies to the thread that stopped."""
+        try:
+            self.non_stop = self.get_onoff(args[1])
+        except ValueError:
+            return
+        if not self.non_stop and self.main_botframe is not None:
+            # Put back the botframe interaction moved into some
+            # thread's stack.
+            self.botframe      = self.main_botframe
+            self.main_botframe = None
+            pass
         return
 
+    def show_non_stop(self, args):
+        "Show whether other threads keep running when one stops"
+        self.msg("Non-stop mode is %s." % fns.show_onoff(self.non_stop))
+        return False
+
     def do_tracethread(self, args):
 
         """Set to trace all threads. However Python 2.5 or the
@@ -382,6 +468,7 @@ stack trace is given for each frame.
                     s += ": %d" % thread_id
             else:
                 s += "    thread id: %d" % thread_id
+            s += self.thread_state(thread_id)
 
             s += "\n    "
             frame = find_nondebug_frame(self, threads[thread_id])
@@ -466,6 +553,7 @@ To get the full stack trace for a specific thread pass in the thread name.
                     s += ": %d" % thread_id
             else:
                 s += "    thread id: %d" % thread_id
+            s += self.thread_state(thread_id)
             s += "\n    "
             s += self.format_stack_entry((frame, frame.f_lineno))
             self.msg('-' * 40)
@@ -481,10 +569,19 @@ To get the full stack trace for a specific thread pass in the thread name.
         else:
             prefix='   '
 
-        self.msg("%s%s: %d" % (prefix, thread_name,
-                               self.traced[thread_name]))
+        thread_id = self.traced[thread_name]
+        self.msg("%s%s: %d%s" % (prefix, thread_name, thread_id,
+                                 self.thread_state(thread_id)))
         return
 
+    def thread_state(self, thread_id):
+        """In non-stop mode return " (running)" or " (stopped)" for
+        thread_id, to be shown after it in thread listings. Otherwise
+        every thread is stopped and we return ''."""
+        if not self.non_stop: return ''
+        if thread_id in self.stopped: return ' (stopped)'
+        return ' (running)'
+
     def info_thread_missing(self):
         """Show information about threads we might not know about"""
         if hasattr(sys, "_current_frames") and \
@@ -573,6 +670,25 @@ To get the full stack trace for a specific thread pass in the thread name.
 ##             self.threading_cond.release()
 ##         return retval
 
+    def interaction(self, frame, tb):
+        """Note the thread that stops, which is the one that steps in
+        non-stop mode, and go into the command loop."""
+        self.step_thread = thread.get_ident()
+        if self.non_stop and frame is not None:
+            # Stepping stops only in frames below botframe, so it has
+            # to be in this thread's stack. The botframe we started
+            # with is kept so set_non_stop can restore it.
+            if self.main_botframe is None:
+                self.main_botframe = self.botframe
+                pass
+            f = frame
+            while f.f_back is not None and f is not self.main_botframe:
+                f = f.f_back
+                pass
+            self.botframe = f
+            pass
+        return pydb.Pdb.interaction(self, frame, tb)
+
     def print_frame_thread(self):
         """Print the thread name and current frame thread name to Pdb's
         print_location, if it is different from the thread name."""
@@ -597,6 +713,21 @@ To get the full stack trace for a specific thread pass in the thread name.
             if thread_id in self.traced.keys():
                 del self.traced[thread_id]
         
+    def lock_dispatch(self):
+        """Take threading_lock. dispatch_gen goes up when the lock is
+        taken and again when it is given back, so it is odd while some
+        thread holds it, and a thread that didn't wait for the lock can
+        tell whether another took it in the meantime."""
+        self.threading_lock.acquire()
+        self.dispatch_gen += 1
+        return
+
+    def unlock_dispatch(self):
+        """Give back threading_lock taken with lock_dispatch."""
+        self.dispatch_gen += 1
+        self.threading_lock.release()
+        return
+
     def trace_dispatch(self, frame, event, arg):
         """Called from Python when some event-like stepping or returning
         occurs
@@ -613,21 +744,22 @@ To get the full stack trace for a specific thread pass in the thread name.
         # threading code which can cause a deadlock.  So avoid the
         # problem rather than try to cope with it - don't trace
         # into threading.
-
-        # FIXME: the below code is not clean or reliable.
-        #        Make more like is_in_threaddbg
-        try: 
-            # "inspect" can return IOError, and on some version of
-            # Python 2.4 inspect has raises an IndexError see 
-            # bug #1673507 
-            (filename, line_no, routine) = inspect.getframeinfo(frame)[0:3]
-        except:
-            return self.trace_dispatch
-            
-        (path, basename)=os.path.split(filename)
-        if basename.startswith('threading.py'):
+        if is_threading_file(frame.f_code.co_filename):
             return self.trace_dispatch
 
+        # Most events can't stop the program: we are continuing and
+        # there is no breakpoint here. Those are handled without the
+        # lock so threads aren't run one at a time. While some thread
+        # holds the lock, say at the command prompt, we fall through
+        # and wait for it like everything else.
+        # fast_event looks at what the thread holding the lock may be
+        # changing, so unless we are in non-stop mode its answer only
+        # stands if no thread took the lock meanwhile.
+        gen  = self.dispatch_gen
+        fast = self.fast_event(frame, event)
+        if fast is not None and (self.non_stop or gen == self.dispatch_gen):
+            return fast[0]
+
         # Note: until locking is done below we should not update and
         # save self.thread_name and self.thread_id but use
         # threading.currentThread().getname and thread.get_ident() instead.
@@ -640,88 +772,145 @@ To get the full stack trace for a specific thread pass in the thread name.
                                                              thread.get_ident()
 
         have_single_entry_lock = False
+        ident = thread.get_ident()
+        self.stopped[ident] = True
+        try:
+            while not self._user_requested_quit: 
+                # See if there was a request to switch to a specific thread
+                while self.desired_thread is not None \
+                      and self.thread_name not in self.desired_thread:
+                    self.threading_cond.acquire()
+                    self.threading_cond.wait()
+                    self.threading_cond.release()
 
-        while not self._user_requested_quit: 
-            # See if there was a request to switch to a specific thread
-            while self.desired_thread is not None \
-                  and self.thread_name not in self.desired_thread:
-                self.threading_cond.acquire()
-                self.threading_cond.wait()
-                self.threading_cond.release()
-
-            # One at a time, please.
-            self.threading_lock.acquire()
-            have_single_entry_lock = True
-            if self.desired_thread is None \
-              or threading.currentThread().getName() in self.desired_thread:
-                break
+                # One at a time, please.
+                self.lock_dispatch()
+                have_single_entry_lock = True
+                if self.desired_thread is None \
+                  or threading.currentThread().getName() in self.desired_thread:
+                    break
 
-            if self._user_requested_quit: break
-            self.threading_lock.release()
-
-        if self.desired_thread != None:
-            # We are switching from another thread
-            # If a breakpoint isn't set at the current
-            # location, we should set up a temporary
-            # breakpoint.
-            if not self.stop_here(self.setup(frame)):
-                arg = str(inspect.getlineno(frame))
-                self.do_tbreak(arg)
-            self.desired_thread = None
-
-        if self._user_requested_quit:
-            self.msg("%s (id %ld) is quitting." %
-                     (threading.currentThread().getName(), thread.get_ident()))
-            if have_single_entry_lock:
-                self.threading_lock.release()
-            thread.exit()
-            return
+                if self._user_requested_quit: break
+                self.unlock_dispatch()
+
+            if self.desired_thread != None:
+                # We are switching from another thread
+                # If a breakpoint isn't set at the current
+                # location, we should set up a temporary
+                # breakpoint.
+                if not self.stop_here(self.setup(frame)):
+                    arg = str(inspect.getlineno(frame))
+                    self.do_tbreak(arg)
+                self.desired_thread = None
+
+            if self._user_requested_quit:
+                self.msg("%s (id %ld) is quitting." %
+                         (threading.currentThread().getName(),
+                          thread.get_ident()))
+                if have_single_entry_lock:
+                    self.unlock_dispatch()
+                thread.exit()
+                return
 
-        # Because of locks above there should not be any chance
-        # that the following assignments will change during the course
-        # of debugger command loop.
-        self.curframe_thread_name = self.thread_name = \
-                                    threading.currentThread().getName()
-        self.thread_id   = thread.get_ident()
-
-        if self.linetrace:
-            # self.msg("thread %s event %s" % (thread_name, event))
-            self.setup(frame)
-            self.print_location()
-        else:
-            while True:
-                try:
-                    if self.stepping and last_thread_id != thread.get_ident():
-                        botframe = self.botframe
-                        self.botframe = frame
-                        #print "Thread switch %s %d %d" % (self.thread_name,
-                        #                                  last_thread_id,
-                        #                                  self.thread_id)
-                    self.nothread_trace_dispatch(self, frame, event, arg)
-                    break
-                except Restart:
-                    sys.argv = list(self._program_sys_argv)
-                    self.msg("'run' command not implemented for thread " +
-                             "debugging. Try 'restart'.")
-                    # self.msg("Should Restart %s with arguments:\n\t%s"
-                    #         % (self.filename(sys.argv[0]),
-                    #            " ".join(self._program_sys_argv[1:])))
-                except bdb.BdbQuit:
-                    self.msg("Requesting exit from %s (id %ld)" %
-                             (threading.currentThread().getName(),
-                              thread.get_ident()))
-                    self._user_requested_quit = True
-                    self.desired_thread = None
-                    self.threading_cond.acquire()
-                    self.threading_cond.notify()
-                    self.threading_cond.release()
-                    self.threading_lock.release()
-                    thread.exit()
-                    return
+            # Because of locks above there should not be any chance
+            # that the following assignments will change during the course
+            # of debugger command loop.
+            self.curframe_thread_name = self.thread_name = \
+                                        threading.currentThread().getName()
+            self.thread_id   = thread.get_ident()
+
+            if self.linetrace:
+                # self.msg("thread %s event %s" % (thread_name, event))
+                self.setup(frame)
+                self.print_location()
+            else:
+                while True:
+                    try:
+                        if self.stepping and \
+                               last_thread_id != thread.get_ident():
+                            botframe = self.botframe
+                            self.botframe = frame
+                            #print "Thread switch %s %d %d" % (self.thread_name,
+                            #                                  last_thread_id,
+                            #                                  self.thread_id)
+                        if event == 'line' and \
+                               thread.get_ident() in self.interrupt_request:
+                            del self.interrupt_request[thread.get_ident()]
+                            self.stop_reason = 'interrupt'
+                            self.interaction(frame, None)
+                        else:
+                            self.nothread_trace_dispatch(self, frame, event,
+                                                         arg)
+                        break
+                    except Restart:
+                        sys.argv = list(self._program_sys_argv)
+                        self.msg("'run' command not implemented for thread " +
+                                 "debugging. Try 'restart'.")
+                        # self.msg("Should Restart %s with arguments:\n\t%s"
+                        #         % (self.filename(sys.argv[0]),
+                        #            " ".join(self._program_sys_argv[1:])))
+                    except bdb.BdbQuit:
+                        self.msg("Requesting exit from %s (id %ld)" %
+                                 (threading.currentThread().getName(),
+                                  thread.get_ident()))
+                        self._user_requested_quit = True
+                        self.desired_thread = None
+                        self.threading_cond.acquire()
+                        self.threading_cond.notify()
+                        self.threading_cond.release()
+                        self.unlock_dispatch()
+                        thread.exit()
+                        return
 
-        self.threading_lock.release()
+            self.unlock_dispatch()
+        finally:
+            # Also when the thread exits (see do_qt), or we'd go on
+            # showing it as stopped.
+            del self.stopped[ident]
+            pass
         return self.trace_dispatch
 
+    def fast_event(self, frame, event):
+        """If event in frame can be handled without stopping or
+        printing, return a one-item tuple holding the trace function
+        to give back to Python. None means the event has to go through
+        the serialized dispatcher."""
+        thread_id = thread.get_ident()
+        if (self.linetrace or self.fntrace
+            or self.desired_thread is not None
+            or self._user_requested_quit or self.quitting
+            or thread_id in self.interrupt_request):
+            return None
+        if self.non_stop and thread_id != self.step_thread:
+            # Stepping and finishing are for the thread that stopped;
+            # other threads stop only at breakpoints.
+            pass
+        elif (self.stepping or self.botframe is None
+              or self.stopframe is not self.botframe
+              or self.returnframe is not None
+              or (not self.non_stop and self.dispatch_gen & 1)):
+            return None
+        # Breakpoints limited to other threads don't count here.
+        lines = self.thread_break_lines(frame.f_code, thread_id)
+        if event == 'line':
+            if lines and (frame.f_lineno in lines
+                          or frame.f_code.co_firstlineno in lines):
+                return None
+            return (self.trace_dispatch,)
+        elif event == 'call':
+            if lines: return None
+            # Record in my own table a list of thread names
+            name = threading.currentThread().getName()
+            if name not in self.traced:
+                self.traced[name] = thread.get_ident()
+                pass
+            if self.break_anywhere(frame):
+                return (self.trace_dispatch,)
+            return (None,)
+        elif event == 'return':
+            return (self.trace_dispatch,)
+        return None
+
     def _runscript(self, filename):
         # Start with fresh empty copy of globals and locals and tell the script
         # that it's being run as __main__ to avoid scripts being able to access
@@ -736,3 +925,6 @@ To get the full stack trace for a specific thread pass in the thread name.
         statement = 'execfile( "%s")' % filename
         self.running = True
         self.run(statement, globals=globals_, locals=locals_)
+
+# Let threadinfo pick out our dispatch frames by their code object.
+dispatch_code['threaddbg'] = threadDbg.trace_dispatch.im_func.func_code
@@ -18,7 +18,47 @@ $Id: threadinfo.py,v 1.5 2007/02/10 01:56:58 rockyb Exp $"""
 #    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
 #    02110-1301 USA.
 
-import inspect, os, sys, threading
+import os, sys, threading
+
+# The code objects of gdb's trace_dispatch_gdb and threaddbg's
+# trace_dispatch, filled in when those modules are loaded. Frames are
+# matched against these by identity.
+dispatch_code = {'gdb' : None, 'threaddbg' : None}
+
+# Frames in files whose basenames start with these are the debugger's
+# (or threading's) and are passed over by find_nondebug_frame.
+skip_basenames = ('threading.py', 'gdb.py', 'threaddbg.py', 'subcmd.py',
+                  'pydb.py')
+
+skip_files      = {}  # co_filename -> True if it is in skip_basenames
+threading_files = {}  # co_filename -> True if it is threading.py
+
+def is_skip_file(filename):
+    """Return True if frames from filename are left out of thread
+    stack traces."""
+    try:
+        return skip_files[filename]
+    except KeyError:
+        basename = os.path.basename(filename)
+        skip = False
+        for prefix in skip_basenames:
+            if basename.startswith(prefix):
+                skip = True
+                break
+            pass
+        skip_files[filename] = skip
+        return skip
+    return
+
+def is_threading_file(filename):
+    """Return True if filename is the threading module."""
+    try:
+        return threading_files[filename]
+    except KeyError:
+        result = os.path.basename(filename).startswith('threading.py')
+        threading_files[filename] = result
+        return result
+    return
 
 def find_nondebug_frame(obj, f):
     """Find the first frame that isn't a debugger frame.
@@ -32,18 +72,10 @@ def find_nondebug_frame(obj, f):
     ### FIXME: would like a routine like is_in_threaddb_dispatch
     ### but works with threading instead. Decorating or subclassing
     ### threadding might do the trick.
-    (filename, line_no, routine) = inspect.getframeinfo(f)[0:3]
-    (path, basename)=os.path.split(filename)
-    while (basename.startswith('threading.py') or
-           basename.startswith('gdb.py') or
-           basename.startswith('threaddbg.py') or
-           basename.startswith('subcmd.py') or
-           basename.startswith('pydb.py') or
-           routine == 'trace_dispatch_gdb') and f.f_back:
+    gdb_code = dispatch_code['gdb']
+    while f.f_back and (f.f_code is gdb_code
+                        or is_skip_file(f.f_code.co_filename)):
         f = f.f_back
-        (filename, line_no, routine) = \
-                   inspect.getframeinfo(f)[0:3]
-        (path, basename)=os.path.split(filename)
     return f
 
 def id2threadName(thread_id):
@@ -53,13 +85,8 @@ def id2threadName(thread_id):
 def is_in_threaddbg_dispatch(f):
     """Returns True if frame f is the threaddbg dispatch routine"""
 
-    ## First check that the routine name and prefix of the filename's
-    ## basename are what we expect.
-
-    (filename, line_no, routine) = inspect.getframeinfo(f)[0:3]
-    (path, basename)=os.path.split(filename)
-    ## print routine, filename
-    if routine != 'trace_dispatch' or not basename.startswith('threaddbg.py'):
+    ## First check that this is the dispatch routine's code.
+    if f.f_code is not dispatch_code['threaddbg']:
         return False
 
     # Next check to see that local variable breadcrumb exists and
@@ -79,8 +106,9 @@ def is_in_threaddbg(f):
     If there is no frame (i.e. no thread debugging) then f would
     be returned."""
     return_frame=f
+    code = dispatch_code['threaddbg']
     while f:
-        if is_in_threaddbg_dispatch(f):
+        if f.f_code is code and is_in_threaddbg_dispatch(f):
             # Can't use previous return_frame
             return_frame = f.f_back
         f = f.f_back
@@ -89,13 +117,8 @@ def is_in_threaddbg(f):
 def is_in_gdb_dispatch(f):
     """Returns True if frame f is the threaddbg dispatch routine"""
 
-    ## First check that the routine name and prefix of the filename's
-    ## basename are what we expect.
-
-    (filename, line_no, routine) = inspect.getframeinfo(f)[0:3]
-    (path, basename)=os.path.split(filename)
-    ## print routine, filename
-    if (routine != 'trace_dispatch_gdb' or not basename.startswith('gdb.py')):
+    ## First check that this is the dispatch routine's code.
+    if f.f_code is not dispatch_code['gdb']:
         return False
 
     # Next check to see that local variable breadcrumb exists and
@@ -115,8 +138,9 @@ def is_in_gdb(f):
     If there is no frame (i.e. no thread debugging) then f would
     be returned."""
     return_frame=f
+    code = dispatch_code['gdb']
     while f:
-        if is_in_gdb_dispatch(f):
+        if f.f_code is code and is_in_gdb_dispatch(f):
             # Can't use previous return_frame
             return_frame = f.f_back
         f = f.f_back
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""Compact binary recording of line and function trace events.
+
+Instead of formatting a location line for each event as "set
+linetrace" does, a TraceRecorder appends a fixed-size record to a
+memory-mapped ring: timestamp, thread id, code id, line number and
+event. Code objects are interned; each new one is given the next code
+id and its file name, function name and first line are appended to a
+small text file next to the recording. When the ring is full the
+oldest records are overwritten, so a long run needs no more space than
+the ring size.
+
+Run this file with the name of a recording to turn it into text.
+"""
+#   Copyright (C) 2009 Rocky Bernstein
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+#    02110-1301 USA.
+
+import mmap, os, struct, sys, thread, time
+
+MAGIC = 'PYDBTRC1'
+
+# magic, record size, unused, ring capacity, records written, start time
+HEADER      = struct.Struct('<8sIIQQd')
+HEADER_SIZE = 64
+COUNT       = struct.Struct('<Q')     # records written, within HEADER
+COUNT_POS   = 24
+
+# timestamp, thread id, code id, line number, event
+RECORD = struct.Struct('<dQIIB3x')
+
+EVENTS     = ('line', 'call', 'return', 'exception')
+EVENT_CODE = dict([(name, i) for i, name in enumerate(EVENTS)])
+
+DEFAULT_SIZE = 1 << 20   # records in the ring
+
+def codes_filename(filename):
+    """Name of the file holding the code table for recording filename."""
+    return filename + '.codes'
+
+class TraceRecorder:
+
+    """Record trace events into a ring of fixed-size binary records.
+
+    If filename is None the ring is kept in anonymous memory and only
+    this process can read it back; otherwise the ring is the file
+    itself and its code table is in codes_filename(filename).
+
+    Threads may record at the same time: each record, and the code id
+    it may need, is made while holding self.lock."""
+
+    def __init__(self, filename=None, size=DEFAULT_SIZE):
+        self.filename  = filename
+        self.capacity  = size
+        self.count     = 0
+        self.start     = time.time()
+        self.codes     = []          # code id -> (filename, name, lineno)
+        self.code_ids  = {}          # code object -> code id
+        self.codes_fileobj = None
+        self.lock      = thread.allocate_lock()
+        length = HEADER_SIZE + size * RECORD.size
+        if filename is None:
+            self.map = mmap.mmap(-1, length)
+        else:
+            fd = os.open(filename, os.O_RDWR|os.O_CREAT|os.O_TRUNC, 0644)
+            try:
+                os.ftruncate(fd, length)
+                self.map = mmap.mmap(fd, length)
+            finally:
+                os.close(fd)
+                pass
+            self.codes_fileobj = open(codes_filename(filename), 'w')
+            pass
+        self.write_header()
+        return
+
+    def write_header(self):
+        HEADER.pack_into(self.map, 0, MAGIC, RECORD.size, 0,
+                         self.capacity, self.count, self.start)
+        return
+
+    def code_id(self, code):
+        """Return the code id for code, interning it if it is new.
+        self.lock must be held."""
+        try:
+            return self.code_ids[code]
+        except KeyError:
+            pass
+        i = len(self.codes)
+        entry = (code.co_filename, code.co_name, code.co_firstlineno)
+        self.codes.append(entry)
+        self.code_ids[code] = i
+        if self.codes_fileobj is not None:
+            self.codes_fileobj.write('%d %d %s %s\n' %
+                                     (i, entry[2], entry[1], entry[0]))
+            self.codes_fileobj.flush()
+            pass
+        return i
+
+    def record(self, frame, event='line'):
+        """Append a record for event in frame."""
+        code = frame.f_code
+        self.lock.acquire()
+        try:
+            try:
+                i = self.code_ids[code]
+            except KeyError:
+                i = self.code_id(code)
+                pass
+            RECORD.pack_into(self.map,
+                             HEADER_SIZE + (self.count % self.capacity)
+                             * RECORD.size,
+                             time.time(), thread.get_ident(), i,
+                             frame.f_lineno, EVENT_CODE[event])
+            self.count += 1
+            COUNT.pack_into(self.map, COUNT_POS, self.count)
+        finally:
+            self.lock.release()
+            pass
+        return
+
+    def sync(self):
+        """Push the recording out to its file."""
+        self.map.flush()
+        return
+
+    def close(self):
+        self.sync()
+        self.map.close()
+        if self.codes_fileobj is not None:
+            self.codes_fileobj.close()
+            self.codes_fileobj = None
+            pass
+        return
+
+    def first(self):
+        """Number of the oldest event still in the ring."""
+        return max(0, self.count - self.capacity)
+
+    def get(self, n):
+        """Return record for event number n as a tuple like the ones
+        records() gives, or None if it is no longer in the ring."""
+        if n < self.first() or n >= self.count: return None
+        t, tid, i, lineno, event = \
+            RECORD.unpack_from(self.map, HEADER_SIZE + (n % self.capacity)
+                               * RECORD.size)
+        return (n, t, tid, i, lineno, EVENTS[event])
+
+    def records(self, last=None):
+        """Return a list of the records still in the ring, oldest
+        first, as (event number, timestamp, thread id, code id, line,
+        event name) tuples. If last is given only that many of the
+        newest records are returned."""
+        return ring_records(self.map, self.capacity, self.count, last)
+
+    pass
+
+def ring_records(buf, capacity, count, last=None):
+    first = max(0, count - capacity)
+    if last is not None:
+        first = max(first, count - last)
+        pass
+    result = []
+    for n in xrange(first, count):
+        t, tid, i, lineno, event = \
+            RECORD.unpack_from(buf, HEADER_SIZE + (n % capacity) * RECORD.size)
+        result.append((n, t, tid, i, lineno, EVENTS[event]))
+        pass
+    return result
+
+def read_trace(filename, last=None):
+    """Read back the recording in filename. Returns a tuple of start
+    time, the list of records as given by TraceRecorder.records and the
+    code table as a dictionary keyed by code id.
+
+    IOError is raised if filename isn't a recording."""
+    f = open(filename, 'rb')
+    try:
+        buf = f.read()
+    finally:
+        f.close()
+        pass
+    if len(buf) < HEADER_SIZE:
+        raise IOError, '%s is not a trace recording' % filename
+    magic, recsize, unused, capacity, count, start = \
+        HEADER.unpack_from(buf, 0)
+    if magic != MAGIC or recsize != RECORD.size:
+        raise IOError, '%s is not a trace recording' % filename
+    codes = {}
+    try:
+        for line in open(codes_filename(filename)):
+            i, lineno, name, co_filename = line.rstrip('\n').split(' ', 3)
+            codes[int(i)] = (co_filename, name, int(lineno))
+            pass
+    except IOError:
+        pass
+    return start, ring_records(buf, capacity, count, last), codes
+
+def format_record(rec, codes, start):
+    """Turn a record into a line of text."""
+    n, t, tid, i, lineno, event = rec
+    try:
+        co_filename, name = codes[i][:2]
+    except (IndexError, KeyError):
+        co_filename, name = '??', '??'
+        pass
+    return '%7d %+11.6f %-6s %s:%d %s [%x]' % \
+        (n, t - start, event, co_filename, lineno, name, tid)
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print "usage: %s recording" % sys.argv[0]
+        sys.exit(1)
+    start, records, codes = read_trace(sys.argv[1])
+    for rec in records:
+        print format_record(rec, codes, start)
+        pass
+    pass
@@ -0,0 +1,19 @@
+# 
+# Test of counter breakpoints: "cbreak" and "sample"
+#
+set basename on
+set trace-commands on
+cbreak gcd
+sample 1 (a, b)
+sample 1 a +
+sample 2 a
+sample 1 undefined_variable
+cbreak 33, a == 1
+break 34
+info break
+continue
+info break
+info display
+sample 1
+info break 
+quit
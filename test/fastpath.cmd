@@ -0,0 +1,20 @@
+# 
+# Test of fast-path dispatch: breakpoints set in functions must
+# still be hit when code without breakpoints is not traced.
+#
+set basename on
+set trace-commands on
+set fastpath on
+show fastpath
+break gcd
+continue
+p a, b
+continue
+p a, b
+break 34
+delete 1
+continue
+p a, b
+set fastpath off
+show fastpath
+quit
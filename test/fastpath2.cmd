@@ -0,0 +1,16 @@
+# 
+# Test of fast-path dispatch: stepping off the end of a function
+# must stop in its caller, even though the caller was entered
+# without line tracing.
+#
+set basename on
+set trace-commands on
+set fastpath on
+break f
+continue
+p x
+step
+step
+step
+p i, total
+quit
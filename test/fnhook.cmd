@@ -0,0 +1,17 @@
+# 
+# Test of function tracing through a profile hook. With only function
+# tracing on, calls come through sys.setprofile; a breakpoint brings
+# back sys.settrace until it is deleted. hook() in fnhook.py returns
+# the hook it sees. Under --fntrace, the commands up to each
+# "continue" are run when the next call is shown.
+#
+set basename on
+continue
+continue
+continue
+continue
+break 9
+continue
+continue
+delete 1
+continue
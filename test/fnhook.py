@@ -0,0 +1,17 @@
+#!/usr/bin/python
+"""Show which trace hook the debugger has installed when a function
+is called, for testing the switch between sys.settrace and
+sys.setprofile when only function tracing is on."""
+import sys
+
+def hook():
+    if sys.getprofile() is not None: return 'profile'
+    if sys.gettrace() is not None: return 'trace'
+    return None
+
+def record(n):
+    print n, hook()
+
+record(1)
+record(2)
+record(3)
@@ -0,0 +1,30 @@
+# 
+# Test of non-stop mode. The main thread stops at a breakpoint while
+# the worker keeps running; then the worker is interrupted and steps
+# on its own. After non-stop is turned off, stepping in the main
+# thread has to work again.
+#
+set basename on
+set non-stop on
+show non-stop
+break 19
+break 21
+continue
+info line
+info thread terse
+interrupt worker
+continue
+info line
+info thread terse
+p done.set()
+next
+info line
+set non-stop off
+continue
+info line
+step
+info line
+next
+info line
+info thread terse
+quit
@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+"""A worker thread that keeps running while the main thread stops.
+Used to test non-stop mode."""
+import threading, time
+
+done = threading.Event()
+go   = threading.Event()
+
+def worker():
+    while not done.isSet(): time.sleep(0.01)
+    go.set()
+
+def finish():
+    t.join()
+
+t = threading.Thread(target=worker, name='worker')
+t.start()
+time.sleep(0.1)
+x = 1
+go.wait()
+y = 2
+finish()
+z = 3
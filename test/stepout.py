@@ -0,0 +1,15 @@
+#!/usr/bin/python
+"""Call a function from a loop, for testing stepping back out of
+a function into its caller."""
+
+def f(x):
+    y = x + 1
+    return y
+
+def g(n):
+    total = 0
+    for i in range(n):
+        total += f(i)
+    return total
+
+print g(3)